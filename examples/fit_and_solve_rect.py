@@ -51,8 +51,14 @@ print("mean rel_err on K_c = ", np.mean( [rel_err(nphc.K_c_th, K_c) for K_c in n
 #################################################
 ### Solve (=> minimize the objective function ###
 #################################################
+np.random.seed(0)
 R_pred = nphc.solve(alpha=.9,training_epochs=300,display_step=20,learning_rate=1e-2,optimizer='adam')
 
 # print final error of estimation
 G_pred = np.eye(d) - inv(R_pred)
 print(rel_err(Alpha,G_pred))
+
+# same optimization without TensorFlow: the days are drawn in the same order
+np.random.seed(0)
+R_pred_numpy = nphc.solve(alpha=.9,training_epochs=300,display_step=20,learning_rate=1e-2,optimizer='adam',backend='numpy')
+print("rel_err between the backends = ", rel_err(R_pred,R_pred_numpy))
@@ -1,30 +1,58 @@
-from numba import double, int32, int64, float64 # autojit, jit, 
-from scipy.linalg import inv, pinv, eigh
-from joblib import Parallel, delayed
-from math import sqrt, pi, exp
-from scipy.stats import norm
-from itertools import product
+# numba, joblib and scipy are imported by the functions which use them, so that importing
+# this module stays cheap
+from math import sqrt, pi, exp, erf
+from itertools import product, combinations_with_replacement
+from functools import partial
+from contextlib import contextmanager, ExitStack
+from tempfile import mkdtemp
+from shutil import rmtree
+import os
+import time
 import numpy as np
+from nphc.realizations import Realizations
+from nphc.utils import cache
+from nphc.utils.stats import Stats, timed_job, logger
 
 
 class Cumulants(object):
+    """
+    `realizations` is either a `Realizations`, a single realization (a list of np.arrays,
+    one per node), a list of such realizations, or any other iterable of realizations, such
+    as a generator loading the days from disk. Lists are copied once into a `Realizations`.
+    In the last case, the days are only consumed by `compute_cumulants`, a few at a time,
+    and are not kept: only the per-day cumulants are.
+
+    With `keep='all'`, L, C, _J, _E_c and K_c hold the cumulants of every day, stacked in
+    preallocated arrays. With `keep='mean'`, they only hold their means across the days, with
+    a leading axis of length 1, updated online as the days are computed, together with the
+    sums of squared deviations to these means (see `get_variance`): whatever the method, the
+    cumulants of a day are dropped once added, see `compute_mean_by_day`.
+
+    `stats` collects the timings of the stages of `compute_cumulants`, see `Stats`: the
+    optional `callback(name, record)` is called at the end of each stage instead of logging it.
+    """
 
-    def __init__(self, realizations=[], half_width=100.):
-        if all(isinstance(x, list) for x in realizations):
-            self.realizations = realizations
+    # the per-day cumulants, kept or averaged
+    _AGGREGATED = ('L', 'C', '_J', '_E_c', 'K_c')
+
+    def __init__(self, realizations=[], half_width=100., keep='all', callback=None):
+        if keep not in ('all', 'mean'):
+            raise ValueError("In `Cumulants`: `keep` should either equal `all` or `mean`.")
+        self.keep = keep
+        self.stats = Stats(callback)
+        self.days = None
+        if not isinstance(realizations, (list, tuple, Realizations)):
+            self.realizations = None
+            self.days = realizations
+            self.dim = None
+            self.n_realizations = None
+            self.time = None
         else:
-            self.realizations = [realizations]
-        self.dim = len(self.realizations[0])
-        self.n_realizations = len(self.realizations)
-        self.time = np.zeros(self.n_realizations)
-        for day, realization in enumerate(self.realizations):
-            T_day = float(max(x[-1] for x in realization if len(x) > 0)) - float(min(x[0] for x in realization if len(x) > 0))
-            self.time[day] = T_day
-        self.L = np.zeros((self.n_realizations, self.dim))
-        self.C = np.zeros((self.n_realizations, self.dim, self.dim))
-        self._J = np.zeros((self.n_realizations, self.dim, self.dim))
-        self._E_c = np.zeros((self.n_realizations, self.dim, self.dim, 2))
-        self.K_c = np.zeros((self.n_realizations, self.dim, self.dim))
+            self.realizations = Realizations.from_lists(realizations)
+            self.dim = self.realizations.dim
+            self.n_realizations = self.realizations.n_realizations
+            self.time = self.realizations.time.copy()
+            self.allocate(self.n_realizations)
         self.L_th = None
         self.C_th = None
         self.K_c_th = None
@@ -32,6 +60,60 @@ class Cumulants(object):
         self.mu_true = None
         self.half_width = half_width
 
+    def allocate(self, n_realizations):
+        """
+        Preallocates the arrays of the cumulants of `n_realizations` days, or of their running
+        means and sums of squared deviations when `keep` equals `mean`.
+        """
+        d = self.dim
+        n = n_realizations if self.keep == 'all' else 1
+        self.L = np.zeros((n, d))
+        self.C = np.zeros((n, d, d))
+        self._J = np.zeros((n, d, d))
+        self._E_c = np.zeros((n, d, d, 2))
+        self.K_c = np.zeros((n, d, d))
+        if self.keep == 'mean':
+            self.n_days = 0
+            self._M2 = dict((attr, np.zeros_like(getattr(self, attr)[0])) for attr in self._AGGREGATED)
+
+    def resize(self, n_realizations):
+        # with keep='all', when the number of days is not known in advance
+        for attr in self._AGGREGATED:
+            old = getattr(self, attr)
+            new = np.zeros((n_realizations,) + old.shape[1:])
+            n = min(n_realizations, old.shape[0])
+            new[:n] = old[:n]
+            setattr(self, attr, new)
+
+    def store_day(self, day, L, C, J, E_c):
+        """
+        Stores the cumulants of the day `day`, or adds them to the running means with Welford's
+        online update when `keep` equals `mean`.
+        """
+        K_c = get_K_c(E_c)
+        if self.keep == 'all':
+            self.L[day] = L
+            self.C[day] = C
+            self._J[day] = J
+            self._E_c[day] = E_c
+            self.K_c[day] = K_c
+            return
+        self.n_days += 1
+        for attr, x in zip(self._AGGREGATED, (L, C, J, E_c, K_c)):
+            mean = getattr(self, attr)[0]
+            delta = x - mean
+            mean += delta / self.n_days
+            self._M2[attr] += delta * (x - mean)
+
+    def get_variance(self, attr):
+        """
+        Returns the unbiased variance across the days of the cumulant `attr`, one of `L`, `C`,
+        `_J`, `_E_c` and `K_c`.
+        """
+        if self.keep == 'mean':
+            return self._M2[attr] / max(self.n_days - 1, 1)
+        return np.var(getattr(self, attr), axis=0, ddof=1)
+
     # ###########
     # ## Decorator to compute the cumulants on each day, and average
     # ###########
@@ -58,15 +140,7 @@ class Cumulants(object):
     #########
 
     def compute_L(self):
-        for day, realization in enumerate(self.realizations):
-            L = np.zeros(self.dim)
-            for i in range(self.dim):
-                process = realization[i]
-                if process is None:
-                    L[i] = -1.
-                else:
-                    L[i] = len(process) / self.time[day]
-            self.L[day] = L.copy()
+        self.L = self.realizations.L.copy()
 
     # def compute_C(self, half_width=0., method='parallel', filtr='rectangular', sigma=1.0):
     #     if half_width == 0.:
@@ -94,89 +168,158 @@ class Cumulants(object):
     #         self.C[day] = C.copy()
 
 
-    def compute_C_and_J(self, half_width=0., method='parallel_by_day', filtr='rectangular', sigma=1.0):
+    def compute_C_and_J(self, half_width=0., method='parallel_by_day', filtr='rectangular', sigma=1.0, backend='python',
+                        use_symmetry=False, n_table=None, parallel=None, shared=None, n_threads=None):
+        """
+        Computes C and J on each realization.
+
+        With `use_symmetry=True`, each unordered pair {i, j} is computed once, as (i, j) with
+        i <= j, and used for both orientations. The estimators of (i, j) and (j, i) count the
+        same pairs of jumps, up to the ties at exactly +/- half_width and to the reference jumps
+        skipped at the edges of the realization (those before half_width, or with no jump of
+        the other node after them). Each skipped jump contributes at most (n + 2 H \Lambda) / T
+        to C and 2 H (n + 2 H \Lambda) / T to J, with n its number of neighbours in the window.
+        The symmetrized C and J then differ from the default ones by at most half the sum of
+        these contributions, which is of order H^2 \Lambda^i \Lambda^j / T for C and
+        H^3 \Lambda^i \Lambda^j / T for J: the order of the edge effects that the
+        symmetrization already removes. `use_symmetry` is ignored by `method='fused'`.
+
+        With `method='parallel_by_component'`, the jobs receive the realizations through the
+        memory-mapped array `shared` (see `shared_realizations`) and are run by the joblib
+        pool `parallel`; both are created for this call when not given.
+
+        `method='threaded'` runs the compiled kernels of the filter on all the pairs of a day
+        in a Numba parallel loop, inside this process and without the GIL, with `n_threads`
+        threads (see `set_threads`), writing directly into C and J.
+        """
+        from joblib import Parallel, delayed
+        check_not_encoded(self.realizations, 'compute_C_and_J')
         if half_width == 0.:
             h_w = self.half_width
         else:
             h_w = half_width
         d = self.dim
 
-        if filtr == "rectangular":
-            A_and_I_ij = A_and_I_ij_rect
-        elif filtr == "gaussian":
-            A_and_I_ij = A_and_I_ij_gauss
-        else:
-            raise ValueError("In `compute_C_and_J`: `filtr` should either equal `rectangular` or `gaussian`.")
+        flt = get_filter(filtr, h_w, sigma, n_table)
+        A_and_I_ij = get_kernel(flt.A_and_I_ij, backend)
 
         if method == 'parallel_by_day':
-            l = Parallel(-1)(delayed(worker_day_C_J)(A_and_I_ij, realization, h_w, T, L, sigma, d) for (realization, T, L) in zip(self.realizations, self.time, self.L))
-            self.C = [0.5*(z.real+z.real.T) for z in l]
-            self._J = [0.5*(z.imag+z.imag.T) for z in l]
+            l = Parallel(-1, return_as='generator')(delayed(timed_job)(worker_day_C_J, A_and_I_ij, realization, h_w, T, L, sigma, d, use_symmetry) for (realization, T, L) in zip(self.realizations, self.time, self.L))
+            for day, z in enumerate(self.stats.jobs('C_and_J', l)):
+                self.C[day] = 0.5*(z.real+z.real.T)
+                self._J[day] = 0.5*(z.imag+z.imag.T)
 
         elif method == 'parallel_by_component':
-            for day in range(len(self.realizations)):
-                realization = self.realizations[day]
-                l = Parallel(-1)(
-                        delayed(A_and_I_ij)(realization[i], realization[j], h_w, self.time[day], self.L[day][j], sigma)
-                        for i in range(d) for j in range(d))
-                C_and_J = np.array(l).reshape(d, d)
-                C = C_and_J.real
-                J = C_and_J.imag
-                # we keep the symmetric part to remove edge effects
-                C[:] = 0.5 * (C + C.T)
-                J[:] = 0.5 * (J + J.T)
-                self.C[day] = C.copy()
-                self._J[day] = J.copy()
+            with ExitStack() as stack:
+                if parallel is None:
+                    parallel = stack.enter_context(Parallel(-1))
+                if shared is None:
+                    shared = stack.enter_context(shared_realizations(self.realizations))
+                flat, offsets = shared
+                for day in range(len(self.realizations)):
+                    ij = list(pairs(d, use_symmetry))
+                    l = self.stats.jobs('C_and_J', parallel(
+                            delayed(timed_job)(worker_nodes, A_and_I_ij, flat, offsets[day], (i, j), h_w, self.time[day], self.L[day][j], sigma)
+                            for (i, j) in ij))
+                    C_and_J = np.zeros((d, d), dtype=complex)
+                    for (i, j), z in zip(ij, l):
+                        C_and_J[i, j] = z
+                        if use_symmetry:
+                            C_and_J[j, i] = z
+                    C = C_and_J.real
+                    J = C_and_J.imag
+                    # we keep the symmetric part to remove edge effects
+                    C[:] = 0.5 * (C + C.T)
+                    J[:] = 0.5 * (J + J.T)
+                    self.C[day] = C.copy()
+                    self._J[day] = J.copy()
 
         elif method == 'classic':
             for day in range(len(self.realizations)):
                 realization = self.realizations[day]
                 C = np.zeros((d,d))
                 J = np.zeros((d, d))
-                for i, j in product(range(d), repeat=2):
+                for i, j in pairs(d, use_symmetry):
                     z = A_and_I_ij(realization[i], realization[j], h_w, self.time[day], self.L[day][j], sigma)
                     C[i,j] = z.real
                     J[i,j] = z.imag
+                    if use_symmetry:
+                        C[j,i] = z.real
+                        J[j,i] = z.imag
                 # we keep the symmetric part to remove edge effects
                 C[:] = 0.5 * (C + C.T)
                 J[:] = 0.5 * (J + J.T)
                 self.C[day] = C.copy()
                 self._J[day] = J.copy()
 
+        elif method == 'threaded':
+            day_C_J = get_threaded_kernel(flt.A_and_I_ij, 'C_J')
+            ij = np.array(list(pairs(d, use_symmetry)), dtype=np.int64)
+            with set_threads(n_threads):
+                for day in range(len(self.realizations)):
+                    flat, offsets = self.realizations.flat(day)
+                    C = np.zeros((d, d))
+                    J = np.zeros((d, d))
+                    day_C_J(flat, offsets, ij, h_w, self.time[day], np.asarray(self.L[day], dtype=float), sigma, C, J)
+                    if use_symmetry:
+                        C = np.triu(C) + np.triu(C, 1).T
+                        J = np.triu(J) + np.triu(J, 1).T
+                    # we keep the symmetric part to remove edge effects
+                    self.C[day] = 0.5 * (C + C.T)
+                    self._J[day] = 0.5 * (J + J.T)
+
+        elif method in ('vectorized', 'window_counts'):
+            # C and J are sums over pairs, so the window counts of `window_counts` do not help here
+            A_and_I_ij = partial(A_and_I_ij_vectorized, filtr=flt)
+            for day in range(len(self.realizations)):
+                z = worker_day_C_J(A_and_I_ij, self.realizations[day], h_w, self.time[day], self.L[day], sigma, d, use_symmetry)
+                # we keep the symmetric part to remove edge effects
+                self.C[day] = 0.5 * (z.real + z.real.T)
+                self._J[day] = 0.5 * (z.imag + z.imag.T)
+
         else:
-            raise ValueError("In `compute_C_and_J`: `method` should either equal `parallel_by_day`, `parallel_by_component` or `classic`.")
+            raise ValueError("In `compute_C_and_J`: `method` should either equal `parallel_by_day`, `parallel_by_component`, `classic`, `vectorized`, `window_counts` or `threaded`.")
 
 
-    def compute_E_c(self, half_width=0., method='parallel_by_day', filtr='rectangular', sigma=1.0):
+    def compute_E_c(self, half_width=0., method='parallel_by_day', filtr='rectangular', sigma=1.0, backend='python', n_table=None,
+                    parallel=None, shared=None, n_threads=None):
+        """
+        Computes E_c on each realization, `parallel`, `shared` and `n_threads` are as in `compute_C_and_J`.
+        """
+        from joblib import Parallel, delayed
+        check_not_encoded(self.realizations, 'compute_E_c')
         if half_width == 0.:
             h_w = self.half_width
         else:
             h_w = half_width
         d = self.dim
 
-        if filtr == "rectangular":
-            E_ijk = E_ijk_rect
-        elif filtr == "gaussian":
-            E_ijk = E_ijk_gauss
-        else:
-            raise ValueError("In `compute_E_c`: `filtr` should either equal `rectangular` or `gaussian`.")
+        flt = get_filter(filtr, h_w, sigma, n_table)
+        E_ijk = get_kernel(flt.E_ijk, backend)
 
         if method == 'parallel_by_day':
-            self._E_c = Parallel(-1)(delayed(worker_day_E)(E_ijk, realization, h_w, T, L, J, sigma, d) for (realization, T, L, J) in zip(self.realizations, self.time, self.L, self._J))
+            l = Parallel(-1, return_as='generator')(delayed(timed_job)(worker_day_E, E_ijk, realization, h_w, T, L, J, sigma, d) for (realization, T, L, J) in zip(self.realizations, self.time, self.L, self._J))
+            for day, E_c in enumerate(self.stats.jobs('E_c', l)):
+                self._E_c[day] = E_c
 
         elif method == 'parallel_by_component':
-            for day in range(len(self.realizations)):
-                realization = self.realizations[day]
-                E_c = np.zeros((d, d, 2))
-                l1 = Parallel(-1)(
-                        delayed(E_ijk)(realization[i], realization[j], realization[j], -h_w, h_w,
-                                            self.time[day], self.L[day][i], self.L[day][j], self._J[day][i, j], sigma) for i in range(d) for j in range(d))
-                l2 = Parallel(-1)(
-                        delayed(E_ijk)(realization[j], realization[j], realization[i], -h_w, h_w,
-                                            self.time[day], self.L[day][j], self.L[day][j], self._J[day][j, j], sigma) for i in range(d) for j in range(d))
-                E_c[:, :, 0] = np.array(l1).reshape(d, d)
-                E_c[:, :, 1] = np.array(l2).reshape(d, d)
-                self._E_c[day] = E_c.copy()
+            with ExitStack() as stack:
+                if parallel is None:
+                    parallel = stack.enter_context(Parallel(-1))
+                if shared is None:
+                    shared = stack.enter_context(shared_realizations(self.realizations))
+                flat, offsets = shared
+                for day in range(len(self.realizations)):
+                    E_c = np.zeros((d, d, 2))
+                    l1 = parallel(
+                            delayed(timed_job)(worker_nodes, E_ijk, flat, offsets[day], (i, j, j), -h_w, h_w,
+                                               self.time[day], self.L[day][i], self.L[day][j], self._J[day][i, j], sigma) for i in range(d) for j in range(d))
+                    l2 = parallel(
+                            delayed(timed_job)(worker_nodes, E_ijk, flat, offsets[day], (j, j, i), -h_w, h_w,
+                                               self.time[day], self.L[day][j], self.L[day][j], self._J[day][j, j], sigma) for i in range(d) for j in range(d))
+                    E_c[:, :, 0] = np.array(list(self.stats.jobs('E_c', l1))).reshape(d, d)
+                    E_c[:, :, 1] = np.array(list(self.stats.jobs('E_c', l2))).reshape(d, d)
+                    self._E_c[day] = E_c.copy()
 
         elif method == 'classic':
             for day in range(len(self.realizations)):
@@ -190,9 +333,282 @@ class Cumulants(object):
                                                   self.time[day], self.L[day][j], self.L[day][j], self._J[day][j, j], sigma)
                 self._E_c[day] = E_c.copy()
 
+        elif method == 'vectorized':
+            E_ijk = partial(E_ijk_vectorized, filtr=flt)
+            for day in range(len(self.realizations)):
+                self._E_c[day] = worker_day_E(E_ijk, self.realizations[day], h_w, self.time[day], self.L[day], self._J[day], sigma, d)
+
+        elif method == 'threaded':
+            day_E = get_threaded_kernel(flt.E_ijk, 'E')
+            with set_threads(n_threads):
+                for day in range(len(self.realizations)):
+                    flat, offsets = self.realizations.flat(day)
+                    E_c = np.zeros((d, d, 2))
+                    day_E(flat, offsets, h_w, self.time[day], np.asarray(self.L[day], dtype=float),
+                          np.asarray(self._J[day], dtype=float), sigma, E_c)
+                    self._E_c[day] = E_c
+
+        elif method == 'window_counts':
+            for day in range(len(self.realizations)):
+                self._E_c[day] = worker_day_E_window_counts(self.realizations[day], h_w, self.time[day], self.L[day], self._J[day], d, flt)
+
+        else:
+            raise ValueError("In `compute_E_c`: `method` should either equal `parallel_by_day`, `parallel_by_component`, `classic`, `vectorized`, `window_counts` or `threaded`.")
+
+    def compute_fused(self, half_width=0., filtr='rectangular', sigma=1.0, n_table=None):
+        """
+        Computes L, C, J and E_c in one traversal per reference node, and one job per realization.
+        This is the only engine which handles run-length encoded realizations.
+        """
+        from joblib import Parallel, delayed
+        if half_width == 0.:
+            h_w = self.half_width
+        else:
+            h_w = half_width
+        flt = get_filter(filtr, h_w, sigma, n_table)
+
+        l = Parallel(-1, return_as='generator')(
+                delayed(timed_job)(worker_day_fused, realization, h_w, T, flt, multiplicity=self.realizations.multiplicity(day))
+                for day, (realization, T) in enumerate(zip(self.realizations, self.time)))
+        for day, z in enumerate(self.stats.jobs('fused', l)):
+            self.store_day(day, *z)
+
+    def compute_sparse(self, half_width=0., filtr='rectangular', sigma=1.0, backend='python', bin_size=None, threshold=0.05):
+        """
+        Computes C, J and K_c on the candidate pairs of `screen_pairs` only, and stores them as
+        lists of scipy.sparse CSR matrices, one per realization. The candidate pairs are the
+        union over the days of the pairs whose binned counts (bins of `bin_size`, 2 H by
+        default) have a correlation above `threshold`, and of the diagonal. The entries of
+        the other pairs are set to zero. `_E_c` holds the pairs (E_c[..., 0], E_c[..., 1]).
+        """
+        from joblib import Parallel, delayed
+        check_not_encoded(self.realizations, 'compute_sparse')
+        if half_width == 0.:
+            h_w = self.half_width
+        else:
+            h_w = half_width
+        if bin_size is None:
+            bin_size = 2 * h_w
+        d = self.dim
+        self.compute_L()
+
+        flt = get_filter(filtr, h_w, sigma)
+        A_and_I_ij = get_kernel(flt.A_and_I_ij, backend)
+        E_ijk = get_kernel(flt.E_ijk, backend)
+
+        with Parallel(-1) as parallel:
+            masks = parallel(delayed(timed_job)(screen_pairs, realization, bin_size, threshold) for realization in self.realizations)
+            self.candidates = np.logical_or.reduce(list(self.stats.jobs('sparse', masks)))
+            rows, cols = np.nonzero(self.candidates)
+            l = list(self.stats.jobs('sparse', parallel(
+                    delayed(timed_job)(worker_day_sparse, A_and_I_ij, E_ijk, realization, h_w, T, L, sigma, rows, cols)
+                    for (realization, T, L) in zip(self.realizations, self.time, self.L))))
+        self.C = [z[0] for z in l]
+        self._J = [z[1] for z in l]
+        self._E_c = [(z[2], z[3]) for z in l]
+        self.K_c = [(2 * E_0 + E_1) / 3. for (E_0, E_1) in self._E_c]
+
+    def compute_merged_stream(self, half_width=0., filtr='rectangular', backend='python'):
+        """
+        Computes L, C, J and E_c with the rectangular filter by sweeping the merged event stream
+        of each day once (see `merged_stream_sums`), at a cost O(N d) per day: the method of
+        choice when the dimension is large. `backend='numba'` compiles the sweep.
+        """
+        from joblib import Parallel, delayed
+        check_not_encoded(self.realizations, 'compute_merged_stream')
+        if half_width == 0.:
+            h_w = self.half_width
+        else:
+            h_w = half_width
+        if filtr != 'rectangular':
+            raise ValueError("In `compute_merged_stream`: `filtr` should equal `rectangular`.")
+
+        l = Parallel(-1, return_as='generator')(delayed(timed_job)(worker_day_merged, *self.realizations.flat(day), h_w, self.time[day], backend)
+                                                for day in range(self.n_realizations))
+        for day, z in enumerate(self.stats.jobs('merged_stream', l)):
+            self.store_day(day, *z)
+
+    def compute_by_block(self, half_width=0., filtr='rectangular', sigma=1.0, n_table=None, n_blocks=None):
+        """
+        Computes L, C, J and E_c with the engine of `compute_fused`, splitting each realization
+        into `n_blocks` time blocks (by default, the number of cores) processed in parallel,
+        see `time_blocks`. The partial sums of the blocks are added exactly, so that a single
+        long realization uses all the cores.
+        """
+        from joblib import Parallel, delayed, cpu_count
+        check_not_encoded(self.realizations, 'compute_by_block')
+        if half_width == 0.:
+            h_w = self.half_width
         else:
+            h_w = half_width
+        flt = get_filter(filtr, h_w, sigma, n_table)
+        if n_blocks is None:
+            n_blocks = cpu_count()
+
+        with Parallel(-1) as parallel:
+            for day, (realization, T) in enumerate(zip(self.realizations, self.time)):
+                L = np.array([x.shape[0] for x in realization]) / T
+                l = self.stats.jobs('parallel_by_block', parallel(
+                        delayed(timed_job)(fused_sums, local, reference, h_w, L, flt)
+                        for (local, reference) in time_blocks(realization, h_w, flt, n_blocks)))
+                self.store_day(day, L, *merge_fused_sums(l, T))
+
+    def compute_from_iterator(self, half_width=0., filtr='rectangular', sigma=1.0, n_table=None):
+        """
+        Computes L, C, J and E_c on the realizations of the iterable given to the constructor,
+        with the engine of `compute_fused`. The days are sent one by one to the workers as they
+        become idle, so that about one day per worker is in memory at any time.
+        """
+        from joblib import Parallel, delayed
+        if half_width == 0.:
+            h_w = self.half_width
+        else:
+            h_w = half_width
+        flt = get_filter(filtr, h_w, sigma, n_table)
+
+        l = Parallel(-1, batch_size=1, pre_dispatch='n_jobs', return_as='generator')(
+                delayed(timed_job)(worker_day_lazy, realization, h_w, flt) for realization in self.days)
+        n = len(self.days) if hasattr(self.days, '__len__') else 16
+        time = []
+        n_events = 0
+        for day, (T, L, C, J, E_c) in enumerate(self.stats.jobs('iterator', l)):
+            if day == 0:
+                self.dim = L.shape[0]
+                self.allocate(n)
+            elif self.keep == 'all' and day == self.L.shape[0]:
+                # the number of days is not known in advance: the arrays are doubled when full
+                self.resize(2 * day)
+            time.append(T)
+            n_events += int(round(L.sum() * T))
+            self.store_day(day, L, C, J, E_c)
+        self.stats.stages['iterator']['n_events'] = n_events
+        self.days = None
+        self.n_realizations = len(time)
+        self.time = np.array(time)
+        if self.keep == 'all':
+            self.resize(self.n_realizations)
+
+    def compute_stages(self, stage, half_width=0., method='parallel_by_day', filtr='rectangular', sigma=1.0,
+                       backend='python', use_symmetry=False, n_table=None, n_threads=None):
+        """
+        Computes L, then C and J, then E_c on every day with the staged `method`, each stage
+        being measured by the context manager `stage(name)`.
+        """
+        from joblib import Parallel
+        with ExitStack() as stack:
+            if method == 'parallel_by_component':
+                # the realizations are shared once, and the pool reused, by the two stages
+                shared = stack.enter_context(shared_realizations(self.realizations))
+                parallel = stack.enter_context(Parallel(-1))
+            else:
+                shared, parallel = None, None
+            with stage('L'):
+                self.compute_L()
+            with stage('C_and_J'):
+                self.compute_C_and_J(half_width=half_width, method=method, filtr=filtr, sigma=sigma, backend=backend,
+                                     use_symmetry=use_symmetry, n_table=n_table, parallel=parallel, shared=shared,
+                                     n_threads=n_threads)
+            with stage('E_c'):
+                self.compute_E_c(half_width=half_width, method=method, filtr=filtr, sigma=sigma, backend=backend,
+                                 n_table=n_table, parallel=parallel, shared=shared, n_threads=n_threads)
+
+    def compute_mean_by_day(self, half_width=0., method='parallel_by_day', filtr='rectangular', sigma=1.0,
+                            backend='python', use_symmetry=False, n_table=None, n_threads=None):
+        """
+        Computes L, C, J and E_c with the staged `method` for `keep='mean'`, adding each day to
+        the running means as soon as it is computed, so that the cumulants of every day are
+        never held together. With `parallel_by_day`, each job computes both stages of its day
+        (see `worker_day_C_J_E`) and the days are streamed back as they are done; the other
+        methods are run on one day at a time.
+        """
+        from joblib import Parallel, delayed
+        check_not_encoded(self.realizations, 'compute_mean_by_day')
+        if half_width == 0.:
+            h_w = self.half_width
+        else:
+            h_w = half_width
+        d = self.dim
 
-            raise ValueError("In `compute_E_c`: the filtering function should be either `rectangular` or `gaussian`.")
+        if method == 'parallel_by_day':
+            flt = get_filter(filtr, h_w, sigma, n_table)
+            A_and_I_ij = get_kernel(flt.A_and_I_ij, backend)
+            E_ijk = get_kernel(flt.E_ijk, backend)
+            l = Parallel(-1, return_as='generator')(
+                    delayed(timed_job)(worker_day_C_J_E, A_and_I_ij, E_ijk, realization, h_w, T, L, sigma, d, use_symmetry)
+                    for (realization, T, L) in zip(self.realizations, self.time, self.realizations.L))
+            for day, (C, J, E_c) in enumerate(self.stats.jobs('mean_by_day', l)):
+                self.store_day(day, self.realizations.L[day], C, J, E_c)
+            return
+
+        with ExitStack() as stack:
+            parallel = stack.enter_context(Parallel(-1)) if method == 'parallel_by_component' else None
+            for day in range(self.n_realizations):
+                cumul = Cumulants(self.realizations[day:day + 1], half_width=self.half_width)
+                cumul.stats = self.stats
+                cumul.compute_L()
+                with ExitStack() as day_stack:
+                    shared = None
+                    if method == 'parallel_by_component':
+                        shared = day_stack.enter_context(shared_realizations(cumul.realizations))
+                    cumul.compute_C_and_J(half_width=half_width, method=method, filtr=filtr, sigma=sigma, backend=backend,
+                                          use_symmetry=use_symmetry, n_table=n_table, parallel=parallel, shared=shared,
+                                          n_threads=n_threads)
+                    cumul.compute_E_c(half_width=half_width, method=method, filtr=filtr, sigma=sigma, backend=backend,
+                                      n_table=n_table, parallel=parallel, shared=shared, n_threads=n_threads)
+                self.store_day(day, cumul.L[0], cumul.C[0], cumul._J[0], cumul._E_c[0])
+
+    def compute_cumulants_sweep(self, half_widths):
+        """
+        Computes L, C, J and K_c with the rectangular filter for every half width of the array
+        `half_widths`, with a single traversal of each realization (see `worker_day_sweep`).
+        The attributes of the object are left unchanged.
+
+        Returns
+        -------
+            L : `np.array` shape=(n_realizations, dim)
+            C, J, K_c : `np.array` shape=(len(half_widths), n_realizations, dim, dim)
+        """
+        from joblib import Parallel, delayed
+        check_not_encoded(self.realizations, 'compute_cumulants_sweep')
+        l = Parallel(-1)(delayed(worker_day_sweep)(realization, half_widths, T) for (realization, T) in zip(self.realizations, self.time))
+        L = np.array([z[0] for z in l])
+        C = np.stack([z[1] for z in l], axis=1)
+        J = np.stack([z[2] for z in l], axis=1)
+        K_c = get_K_c(np.stack([z[3] for z in l], axis=1))
+        return L, C, J, K_c
+
+    def profile_pairs(self, n_pairs=10, half_width=0., filtr='rectangular', sigma=1.0, backend='python', n_table=None,
+                      seed=None):
+        """
+        Times, in this process, the kernels of C and J and of E_c on `n_pairs` pairs (i, j) of the
+        first realization drawn at random, to find the pairs which dominate the computation.
+        The times are stored in `stats.pairs['C_and_J']` and `stats.pairs['E_c']`, keyed by (i, j).
+        """
+        if half_width == 0.:
+            h_w = self.half_width
+        else:
+            h_w = half_width
+        if self.realizations is None:
+            raise ValueError("In `profile_pairs`: the realizations should not be given as an iterable.")
+        d = self.dim
+        flt = get_filter(filtr, h_w, sigma, n_table)
+        A_and_I_ij = get_kernel(flt.A_and_I_ij, backend)
+        E_ijk = get_kernel(flt.E_ijk, backend)
+        realization, T, L = self.realizations[0], self.realizations.time[0], self.realizations.L[0]
+        sampled = np.random.RandomState(seed).choice(d * d, size=min(n_pairs, d * d), replace=False)
+        # the first call compiles the numba kernels
+        z = A_and_I_ij(realization[0], realization[0], h_w, T, L[0], sigma)
+        E_ijk(realization[0], realization[0], realization[0], -h_w, h_w, T, L[0], L[0], z.imag, sigma)
+        times_C_J = self.stats.pairs.setdefault('C_and_J', {})
+        times_E = self.stats.pairs.setdefault('E_c', {})
+        for k in sampled:
+            i, j = divmod(int(k), d)
+            start = time.perf_counter()
+            z = A_and_I_ij(realization[i], realization[j], h_w, T, L[j], sigma)
+            times_C_J[(i, j)] = time.perf_counter() - start
+            start = time.perf_counter()
+            E_ijk(realization[i], realization[j], realization[j], -h_w, h_w, T, L[i], L[j], z.imag, sigma)
+            times_E[(i, j)] = time.perf_counter() - start
 
     def set_R_true(self, R_true):
         self.R_true = R_true
@@ -213,30 +629,299 @@ class Cumulants(object):
         assert self.R_true is not None, "You should provide R_true."
         self.K_c_th = get_K_c_th(self.L_th, self.C_th, self.R_true)
 
-    def compute_cumulants(self, half_width=0., method="parallel_by_day", filtr='rectangular', sigma=0.):
-        self.compute_L()
-        print("L is computed")
-        if filtr == "gaussian" and sigma == 0.: sigma = half_width/5.
-        self.compute_C_and_J(half_width=half_width, method=method, filtr=filtr, sigma=sigma)
-        print("C is computed")
-        self.compute_E_c(half_width=half_width, method=method, filtr=filtr, sigma=sigma)
-        self.K_c = [get_K_c(self._E_c[day]) for day in range(self.n_realizations)]
-        print("K_c is computed")
+    def compute_cumulants(self, half_width=0., method="parallel_by_day", filtr='rectangular', sigma=0., backend='python',
+                          use_symmetry=False, n_table=None, n_blocks=None, n_threads=None, cache_dir=None,
+                          cache_size=2 ** 30, sample_pairs=0):
+        """
+        Computes L, C, J and K_c on each realization.
+
+        `filtr` is the name of a filter registered in `FILTERS`, `rectangular` or `gaussian`.
+        `method` is one of `parallel_by_day`, `parallel_by_component`, `classic` (loops over
+        the jumps), `vectorized` (array operations on each pair, no compilation needed),
+        `window_counts` (same as `vectorized`, with E_c obtained from one matrix of window
+        sums per reference node instead of one pass per pair), `fused` (L, C, J and E_c
+        from a single traversal of each day, with one job per day), `parallel_by_block`
+        (same as `fused`, with each day split into `n_blocks` time blocks computed in parallel),
+        `threaded` (compiled loops run on the pairs by `n_threads` threads, in this process),
+        `merged_stream` (rectangular filter only, one sweep of the merged jumps of all the
+        nodes, in O(N d) instead of O(N d^2): best for large dimensions) or `sparse` (C, J
+        and K_c as sparse matrices, on the pairs selected by a cheap screening stage only,
+        see `compute_sparse`).
+        `backend` selects the implementation of the loops: `python` for the reference
+        pure-Python loops, `numba` for their compiled (nopython, nogil) counterparts.
+        `use_symmetry` computes C and J on the pairs i <= j only, see `compute_C_and_J`.
+        `n_table` makes the array methods read the weights of smooth filters in a table of
+        `n_table` points, see `get_filter`.
+        When the realizations were given as an iterable, they are always processed by the engine
+        of `method='fused'`, see `compute_from_iterator`. So are run-length encoded realizations
+        (see `Realizations.run_length_encode`), which give the same estimators as the repeated
+        times, with a warning when another `method` is asked for (`sparse` raises a
+        ValueError); the other `compute_*` methods raise a ValueError on them.
+        With `cache_dir`, L, C, J, E_c and K_c are looked up in the on-disk cache of this folder,
+        keyed by the timestamps and the parameters of the estimators (all the methods but
+        `sparse` compute the same estimators, up to `use_symmetry`, which only the methods
+        computing C and J pair by pair use, and `n_table`, which only the array methods use),
+        and stored there after being computed.
+        The cache takes at most `cache_size` bytes, see `nphc.utils.cache`.
+        Realizations given as an iterable, and the means of `keep='mean'`, are not cached.
+        With `keep='mean'`, only the running means are held: the methods which compute C, J
+        and E_c in separate stages run them one day at a time, see `compute_mean_by_day`.
+        Each stage is timed in `stats` (see `Stats`) and reported to the callback given to the
+        constructor, or to the `nphc` logger; with `sample_pairs` > 0, the kernels are also
+        timed on that many pairs, see `profile_pairs`.
+        """
+        from joblib import cpu_count
+        if sigma == 0. and filtr in FILTERS:
+            sigma = FILTERS[filtr].default_sigma(half_width if half_width != 0. else self.half_width)
+        if self.keep == 'mean' and method == 'sparse':
+            raise ValueError("In `compute_cumulants`: `keep='mean'` is not available with `method='sparse'`.")
+        if self.realizations is not None and self.realizations.multiplicities is not None:
+            if method == 'sparse':
+                raise ValueError("In `compute_cumulants`: `method='sparse'` is not available with run-length encoded realizations.")
+            if method != 'fused':
+                logger.warning("Run-length encoded realizations are computed with `method='fused'` instead of `%s`.", method)
+        key = None
+        if cache_dir is not None and self.realizations is not None and method != 'sparse' and self.keep == 'all':
+            # the parameters ignored by the engine which will run are left out of the key
+            engine = 'fused' if self.realizations.multiplicities is not None else method
+            key_symmetry = use_symmetry and engine not in ('fused', 'parallel_by_block', 'merged_stream')
+            key_table = n_table if engine in ('vectorized', 'window_counts', 'fused', 'parallel_by_block') else None
+            key = cache.cache_key(self.realizations, half_width=half_width if half_width != 0. else self.half_width,
+                                  filtr=filtr, sigma=sigma, use_symmetry=key_symmetry, n_table=key_table)
+            cached = cache.load(cache_dir, key)
+            if cached is not None:
+                self.L = cached['L']
+                self.C = cached['C']
+                self._J = cached['J']
+                self._E_c = cached['E_c']
+                self.K_c = cached['K_c']
+                logger.info("L, C and K_c are loaded from the cache")
+                self.set_theoretical_cumulants()
+                return
+        one_pass = self.realizations is None or self.realizations.multiplicities is not None \
+                   or method in ('fused', 'parallel_by_block', 'merged_stream')
+        if self.realizations is not None:
+            self.allocate(self.n_realizations)
+        n_events = 0 if self.realizations is None else int(self.realizations.counts.sum())
+        stage = partial(self.stats.stage, n_events=n_events, n_workers=cpu_count())
+        if self.realizations is None:
+            with stage('iterator'):
+                self.compute_from_iterator(half_width=half_width, filtr=filtr, sigma=sigma, n_table=n_table)
+        elif method == 'fused' or self.realizations.multiplicities is not None:
+            with stage('fused'):
+                self.compute_fused(half_width=half_width, filtr=filtr, sigma=sigma, n_table=n_table)
+        elif method == 'sparse':
+            with stage('sparse'):
+                self.compute_sparse(half_width=half_width, filtr=filtr, sigma=sigma, backend=backend)
+        elif method == 'merged_stream':
+            with stage('merged_stream'):
+                self.compute_merged_stream(half_width=half_width, filtr=filtr, backend=backend)
+        elif method == 'parallel_by_block':
+            with stage('parallel_by_block'):
+                self.compute_by_block(half_width=half_width, filtr=filtr, sigma=sigma, n_table=n_table, n_blocks=n_blocks)
+        else:
+            if method not in ('parallel_by_day', 'parallel_by_component'):
+                # the other methods run in this process
+                stage = partial(self.stats.stage, n_events=n_events)
+            if self.keep == 'mean':
+                with stage('mean_by_day'):
+                    self.compute_mean_by_day(half_width=half_width, method=method, filtr=filtr, sigma=sigma,
+                                             backend=backend, use_symmetry=use_symmetry, n_table=n_table,
+                                             n_threads=n_threads)
+            else:
+                self.compute_stages(stage, half_width=half_width, method=method, filtr=filtr, sigma=sigma,
+                                    backend=backend, use_symmetry=use_symmetry, n_table=n_table, n_threads=n_threads)
+        if not one_pass and method != 'sparse' and self.keep == 'all':
+            with self.stats.stage('K_c', n_events=n_events):
+                self.K_c = get_K_c(self._E_c)
+        if sample_pairs > 0 and self.realizations is not None:
+            self.profile_pairs(sample_pairs, half_width=half_width, filtr=filtr, sigma=sigma, backend=backend,
+                               n_table=n_table)
+        if key is not None:
+            cache.store(cache_dir, key, {'L': self.L, 'C': self.C, 'J': self._J, 'E_c': self._E_c, 'K_c': self.K_c},
+                        max_size=cache_size)
+        self.set_theoretical_cumulants()
+
+    def set_theoretical_cumulants(self):
         if self.R_true is not None and self.mu_true is not None:
             self.set_L_th()
             self.set_C_th()
             self.set_K_c_th()
 
 
+class StreamingCumulants(object):
+    """
+    Computes L, C, J and K_c of a single realization whose jumps arrive over time.
+
+    The jumps of each node are appended with `append` (or `extend` for all the nodes at once),
+    in increasing order for each node; the nodes do not need to be synchronized. Only running
+    sums are kept. A jump \tau of node k enters the estimators involving node j as soon as a
+    jump of node j happens after the window of \tau (\tau + width for C and J, \tau + H for
+    E_c), which is exactly the condition under which the batch estimators use it: the jumps
+    still waiting for it form the pending buffer at the right edge. The trend terms depend on
+    L, so they are applied when the cumulants are read. Once the stream is over, the
+    attributes equal those of `Cumulants` on the same realization, up to floating-point
+    rounding. A node which stays silent keeps the jumps of the other nodes pending.
+
+    Attributes
+    ----------
+
+        L : `np.array` shape=(dim,)
+        C, J, K_c : `np.array` shape=(dim,dim)
+        E_c : `np.array` shape=(dim,dim,2)
+    """
+
+    def __init__(self, dim, half_width=100., filtr='rectangular', sigma=0., n_table=None):
+        self.dim = dim
+        self.half_width = half_width
+        if sigma == 0.:
+            sigma = FILTERS[filtr].default_sigma(half_width) if filtr in FILTERS else 1.0
+        self.filter = get_filter(filtr, half_width, sigma, n_table)
+        self.trend_E = self.filter.trend_E(-half_width, half_width)
+        d = dim
+        # retained jumps of each node, `base` of them have already been dropped
+        self.buffers = [np.zeros(0) for _ in range(d)]
+        self.base = np.zeros(d, dtype=np.int64)
+        self.n = np.zeros(d, dtype=np.int64)
+        self.first = np.inf
+        self.last = -np.inf * np.ones(d)
+        # number of jumps of node k already used with node j, for C and J, E_c[., k, 0], E_c[k, ., 1]
+        self.settled_C = np.zeros((d, d), dtype=np.int64)
+        self.settled_E0 = np.zeros((d, d), dtype=np.int64)
+        self.settled_E1 = np.zeros((d, d), dtype=np.int64)
+        # running sums, the reference node being the first index
+        self.sum_C = np.zeros((d, d))
+        self.sum_J = np.zeros((d, d))
+        self.n_C = np.zeros((d, d))
+        self.sum_prod = np.zeros((d, d))
+        self.sum_E0_i = np.zeros((d, d))
+        self.sum_E0_k = np.zeros((d, d))
+        self.n_E0 = np.zeros((d, d))
+        self.sum_sq = np.zeros((d, d))
+        self.sum_E1 = np.zeros((d, d))
+        self.n_E1 = np.zeros((d, d))
+
+    def append(self, node, timestamps):
+        timestamps = np.asarray(timestamps, dtype=float)
+        if timestamps.shape[0] == 0:
+            return
+        self.buffers[node] = np.concatenate((self.buffers[node], timestamps))
+        self.n[node] += timestamps.shape[0]
+        self.last[node] = timestamps[-1]
+        self.first = min(self.first, timestamps[0])
+        for other in range(self.dim):
+            self._settle(node, other)
+            if other != node:
+                self._settle(other, node)
+        self._drop()
+
+    def extend(self, realization):
+        for node, timestamps in enumerate(realization):
+            self.append(node, timestamps)
+
+    def _pending(self, k, settled, bound):
+        # jumps of node k not used yet, and for which a jump happens after \tau + bound
+        buffer_k = self.buffers[k]
+        start = settled - self.base[k]
+        stop = np.searchsorted(buffer_k, bound, side='right')
+        tau = buffer_k[start:max(start, stop)]
+        return tau[tau - self.half_width >= 0], self.base[k] + max(start, stop)
+
+    def _settle(self, k, j):
+        flt = self.filter
+        h_w = self.half_width
+
+        tau, self.settled_C[k, j] = self._pending(k, self.settled_C[k, j], self.last[j] - flt.width)
+        if tau.shape[0] > 0:
+            sum_C, sum_J, _ = flt.C_and_J_sums(tau, self.buffers[j])
+            self.sum_C[k, j] += np.sum(sum_C)
+            self.sum_J[k, j] += np.sum(sum_J)
+            self.n_C[k, j] += tau.shape[0]
+
+        tau, self.settled_E1[k, j] = self._pending(k, self.settled_E1[k, j], self.last[j] - h_w)
+        if tau.shape[0] > 0:
+            sum_j, _ = flt.E_sums(tau, self.buffers[j], -h_w, h_w)
+            self.sum_sq[k, j] += np.dot(sum_j, sum_j)
+            self.sum_E1[k, j] += np.sum(sum_j)
+            self.n_E1[k, j] += tau.shape[0]
+
+        tau, self.settled_E0[k, j] = self._pending(k, self.settled_E0[k, j], min(self.last[j], self.last[k]) - h_w)
+        if tau.shape[0] > 0:
+            sum_j, _ = flt.E_sums(tau, self.buffers[j], -h_w, h_w)
+            sum_k, _ = flt.E_sums(tau, self.buffers[k], -h_w, h_w)
+            self.sum_prod[k, j] += np.dot(sum_j, sum_k)
+            self.sum_E0_i[k, j] += np.sum(sum_j)
+            self.sum_E0_k[k, j] += np.sum(sum_k)
+            self.n_E0[k, j] += tau.shape[0]
+
+    def _drop(self):
+        # the jumps used with every node, and older than the windows of all the pending jumps, are dropped
+        settled = np.minimum(np.minimum(self.settled_C.min(axis=1), self.settled_E0.min(axis=1)), self.settled_E1.min(axis=1))
+        cut = np.inf
+        for k in range(self.dim):
+            if settled[k] < self.n[k]:
+                cut = min(cut, self.buffers[k][settled[k] - self.base[k]])
+        cut -= self.filter.width
+        for k in range(self.dim):
+            stop = min(settled[k] - self.base[k], np.searchsorted(self.buffers[k], cut, side='right'))
+            if stop > 0:
+                self.buffers[k] = self.buffers[k][stop:]
+                self.base[k] += stop
+
+    @property
+    def time(self):
+        return max(self.last.max() - self.first, 0.)
+
+    @property
+    def L(self):
+        T = self.time
+        return self.n / T if T > 0 else np.zeros(self.dim)
+
+    @property
+    def C(self):
+        C = (self.sum_C - self.n_C * self.L[np.newaxis, :] * self.filter.trend_C) / self.time
+        # we keep the symmetric part to remove edge effects
+        return 0.5 * (C + C.T)
+
+    @property
+    def J(self):
+        J = (self.sum_J - self.n_C * self.L[np.newaxis, :] * self.filter.trend_J) / self.time
+        return 0.5 * (J + J.T)
+
+    @property
+    def E_c(self):
+        L = self.L
+        J = self.J
+        w = self.trend_E
+        L_i = L[np.newaxis, :]
+        L_k = L[:, np.newaxis]
+        E_c = np.zeros((self.dim, self.dim, 2))
+        # E_c[i, k, 0], stored with the reference node k first
+        E_0 = self.sum_prod - w * L_k * self.sum_E0_i - w * L_i * self.sum_E0_k \
+              + self.n_E0 * L_i * L_k * w ** 2 - J.T * self.n_E0
+        E_c[:, :, 0] = E_0.T / self.time
+        E_c[:, :, 1] = (self.sum_sq - 2 * w * L_i * self.sum_E1 + self.n_E1 * L_i ** 2 * w ** 2
+                        - np.diag(J)[np.newaxis, :] * self.n_E1) / self.time
+        return E_c
+
+    @property
+    def K_c(self):
+        return get_K_c(self.E_c)
+
+
 ###########
 ## Empirical cumulants with formula from the paper
 ###########
 
+def get_time(realization):
+    return float(max(x[-1] for x in realization if len(x) > 0)) - float(min(x[0] for x in realization if len(x) > 0))
+
+
 # @autojit
 def get_K_c(E_c):
-    K_c = np.zeros_like(E_c[:, :, 0])
-    K_c += 2 * E_c[:, :, 0]
-    K_c += E_c[:, :, 1]
+    K_c = np.zeros_like(E_c[..., 0])
+    K_c += 2 * E_c[..., 0]
+    K_c += E_c[..., 1]
     K_c /= 3.
     return K_c
 
@@ -330,7 +1015,7 @@ def A_ij_gauss(realization_i, realization_j, a, b, T, L_j, sigma=1.0):
     n_i = realization_i.shape[0]
     n_j = realization_j.shape[0]
 
-    trend_j = L_j * sigma * sqrt(2 * pi) * (norm.cdf(b/sigma) - norm.cdf(a/sigma))
+    trend_j = L_j * sigma * sqrt(pi / 2) * (erf(b/(sqrt(2)*sigma)) - erf(a/(sqrt(2)*sigma)))
 
     for t in range(n_i):
         # count the number of jumps
@@ -424,8 +1109,8 @@ def E_ijk_gauss(realization_i, realization_j, realization_k, a, b, T, L_i, L_j,
     n_j = realization_j.shape[0]
     n_k = realization_k.shape[0]
 
-    trend_i = L_i * sigma * sqrt(2 * pi) * (norm.cdf(b/sigma) - norm.cdf(a/sigma))
-    trend_j = L_j * sigma * sqrt(2 * pi) * (norm.cdf(b/sigma) - norm.cdf(a/sigma))
+    trend_i = L_i * sigma * sqrt(pi / 2) * (erf(b/(sqrt(2)*sigma)) - erf(a/(sqrt(2)*sigma)))
+    trend_j = L_j * sigma * sqrt(pi / 2) * (erf(b/(sqrt(2)*sigma)) - erf(a/(sqrt(2)*sigma)))
 
     for t in range(n_k):
         tau = realization_k[t]
@@ -574,8 +1259,8 @@ def A_and_I_ij_gauss(realization_i, realization_j, half_width, T, L_j, sigma=1.0
     res_J = 0
     u = 0
     width = sqrt(2) * half_width
-    trend_C_j = L_j * sigma * sqrt(2 * pi) * (norm.cdf(half_width/sigma) - norm.cdf(-half_width/sigma))
-    trend_J_j = L_j * sigma**2 * 2 * pi * (norm.cdf(half_width/(sqrt(2)*sigma)) - norm.cdf(-half_width/(sqrt(2)*sigma)))
+    trend_C_j = L_j * sigma * sqrt(2 * pi) * erf(half_width/(sqrt(2)*sigma))
+    trend_J_j = L_j * sigma**2 * 2 * pi * erf(half_width/(2*sigma))
 
     for t in range(n_i):
         tau = realization_i[t]
@@ -615,16 +1300,663 @@ def A_and_I_ij_gauss(realization_i, realization_j, half_width, T, L_j, sigma=1.0
     return res_C + res_J * 1j
 
 
-def worker_day_C_J(fun, realization, h_w, T, L, sigma, d):
+##########
+## Filters
+##########
+
+# A filter gives the weights of the jumps \tau' of N^j around a jump \tau as vectorized
+# functions of \tau' - \tau, for C (on [-H, H)), for J (on (-W, W), W being the attribute
+# `width`) and for E (on (a, b)), together with the matching trend constants, that is the
+# terms of the estimators proportional to \Lambda^j. The loops `A_and_I_ij` and `E_ijk` are
+# the reference implementations used by the methods `classic`, `parallel_by_day` and
+# `parallel_by_component`; the other methods only rely on the vectorized weights.
+# A new filter is added by subclassing `Filter` with `@register_filter`.
+
+FILTERS = {}
+
+
+def register_filter(cls):
+    FILTERS[cls.name] = cls
+    return cls
+
+
+def get_filter(filtr, half_width, sigma=1.0, n_table=None):
+    """
+    Returns the filter named `filtr` (see `FILTERS`) for the given half width and sigma.
+    When `n_table` is set, the weights of smooth filters are read in a table of `n_table`
+    points spanning the support of the filter, instead of being computed on every pair of
+    jumps. With 2^16 points and the default sigma, the error on the gaussian weights is about 1e-4.
+    """
+    if isinstance(filtr, Filter):
+        return filtr
+    if filtr not in FILTERS:
+        raise ValueError("`filtr` should be one of %s." % ", ".join("`%s`" % name for name in sorted(FILTERS)))
+    return FILTERS[filtr](half_width, sigma, n_table)
+
+
+def neighbours(tau, realization_j, lo, hi):
+    """
+    Returns, for all the pairs (t, v) with lo[t] <= v < hi[t], the indices t and v and \tau'_v - \tau_t.
+    """
+    n_neighbours = hi - lo
+    rows = np.repeat(np.arange(tau.shape[0]), n_neighbours)
+    starts = np.repeat(lo - (np.cumsum(n_neighbours) - n_neighbours), n_neighbours)
+    index = starts + np.arange(rows.shape[0])
+    delta = realization_j[index] - tau[rows]
+    return rows, index, delta
+
+
+class Filter(object):
+    """
+    Base class of the filters, see above. Subclasses define the support `width` of the
+    weights of J, the trend constants and the raw weights; the weighted sums used by the
+    vectorized estimators enumerate the pairs of jumps, unless a subclass overrides them.
+    """
+
+    name = None
+    smooth = True
+    A_and_I_ij = None
+    E_ijk = None
+
+    def __init__(self, half_width, sigma=1.0, n_table=None):
+        self.half_width = half_width
+        self.sigma = sigma
+        self.width = self.get_width()
+        self.trend_C = self.get_trend_C()
+        self.trend_J = self.get_trend_J()
+        self.tables = None
+        if n_table is not None and self.smooth:
+            grid = np.linspace(-self.width, self.width, n_table)
+            self.tables = (grid[0], (n_table - 1) / (grid[-1] - grid[0]),
+                           self.raw_weight_C(grid), self.raw_weight_J(grid))
+
+    @classmethod
+    def default_sigma(cls, half_width):
+        return 1.0
+
+    def get_width(self):
+        raise NotImplementedError
+
+    def get_trend_C(self):
+        raise NotImplementedError
+
+    def get_trend_J(self):
+        raise NotImplementedError
+
+    def trend_E(self, a, b):
+        raise NotImplementedError
+
+    def raw_weight_C(self, delta):
+        raise NotImplementedError
+
+    def raw_weight_J(self, delta):
+        raise NotImplementedError
+
+    def lookup(self, delta, values):
+        # nearest point of the table, the error is at most half a step times the derivative
+        ind = np.rint((delta - self.tables[0]) * self.tables[1]).astype(np.intp)
+        return values[np.clip(ind, 0, values.shape[0] - 1)]
+
+    def weight_C(self, delta):
+        if self.tables is None:
+            return self.raw_weight_C(delta)
+        return self.lookup(delta, self.tables[2])
+
+    def weight_J(self, delta):
+        if self.tables is None:
+            return self.raw_weight_J(delta)
+        return self.lookup(delta, self.tables[3])
+
+    # the weights of E are those of C
+    weight_E = weight_C
+
+    def C_and_J_sums(self, tau, realization_j, cumsum_j=None, multiplicity_j=None, cumcount_j=None):
+        """
+        For each \tau, computes the weighted sums of the jumps of N^j used by C and J, and
+        whether a jump of N^j happens after \tau + width.
+        When `multiplicity_j` is given, `realization_j` holds distinct times and each of them
+        counts for its multiplicity (see `Realizations.run_length_encode`). `cumsum_j` and
+        `cumcount_j` are the cumulative sums of the times (times their multiplicities) and of
+        the multiplicities, with a leading zero, computed when not given.
+        """
+        n_j = realization_j.shape[0]
+        lo = np.searchsorted(realization_j, tau - self.width, side='right')
+        hi = np.searchsorted(realization_j, tau + self.width, side='left')
+        rows, index, delta = neighbours(tau, realization_j, lo, hi)
+        weights_C = self.weight_C(delta)
+        weights_J = self.weight_J(delta)
+        if multiplicity_j is not None:
+            weights_C *= multiplicity_j[index]
+            weights_J *= multiplicity_j[index]
+        in_C = (delta >= -self.half_width) & (delta < self.half_width)
+        sum_C = np.bincount(rows[in_C], weights=weights_C[in_C], minlength=tau.shape[0])
+        sum_J = np.bincount(rows, weights=weights_J, minlength=tau.shape[0])
+        return sum_C, sum_J, hi < n_j
+
+    def E_sums(self, tau, realization_i, a, b, multiplicity_i=None, cumcount_i=None):
+        """
+        For each \tau, computes the weighted sum of the jumps of N^i in (\tau + a, \tau + b),
+        and whether a jump of N^i happens after \tau + b. `multiplicity_i` and `cumcount_i`
+        are as in `C_and_J_sums`.
+        """
+        n_i = realization_i.shape[0]
+        lo = np.searchsorted(realization_i, tau + a, side='right')
+        hi = np.searchsorted(realization_i, tau + b, side='left')
+        rows, index, delta = neighbours(tau, realization_i, lo, hi)
+        weights = self.weight_E(delta)
+        if multiplicity_i is not None:
+            weights *= multiplicity_i[index]
+        sum_E = np.bincount(rows, weights=weights, minlength=tau.shape[0])
+        return sum_E, hi < n_i
+
+
+@register_filter
+class RectangularFilter(Filter):
+    """
+    f = 1 on [-H, H). The weighted sums are numbers of jumps, and the sums of J are obtained
+    from a cumulative sum of the timestamps, so that no pair of jumps is enumerated.
+    """
+
+    name = 'rectangular'
+    smooth = False
+    A_and_I_ij = staticmethod(A_and_I_ij_rect)
+    E_ijk = staticmethod(E_ijk_rect)
+
+    def get_width(self):
+        return 2 * self.half_width
+
+    def get_trend_C(self):
+        return self.width
+
+    def get_trend_J(self):
+        return self.width ** 2
+
+    def trend_E(self, a, b):
+        return b - a
+
+    def raw_weight_C(self, delta):
+        return np.ones_like(delta)
+
+    def raw_weight_J(self, delta):
+        return self.width - np.abs(delta)
+
+    def C_and_J_sums(self, tau, realization_j, cumsum_j=None, multiplicity_j=None, cumcount_j=None):
+        n_j = realization_j.shape[0]
+        width = self.width
+        if cumsum_j is None:
+            cumsum_j = np.zeros(n_j + 1)
+            if multiplicity_j is None:
+                np.cumsum(realization_j, out=cumsum_j[1:])
+            else:
+                np.cumsum(realization_j * multiplicity_j, out=cumsum_j[1:])
+        if multiplicity_j is None:
+            count = lambda lo, hi: hi - lo
+        else:
+            if cumcount_j is None:
+                cumcount_j = np.zeros(n_j + 1)
+                np.cumsum(multiplicity_j, out=cumcount_j[1:])
+            count = lambda lo, hi: cumcount_j[hi] - cumcount_j[lo]
+        lo = np.searchsorted(realization_j, tau - width, side='right')
+        mid = np.searchsorted(realization_j, tau, side='left')
+        hi = np.searchsorted(realization_j, tau + width, side='left')
+        sum_C = count(np.searchsorted(realization_j, tau - self.half_width, side='left'),
+                      np.searchsorted(realization_j, tau + self.half_width, side='left'))
+        n_left = count(lo, mid)
+        n_right = count(mid, hi)
+        sum_J = width * (n_left + n_right) \
+                + (cumsum_j[mid] - cumsum_j[lo]) - tau * n_left \
+                - (cumsum_j[hi] - cumsum_j[mid]) + tau * n_right
+        return sum_C, sum_J, hi < n_j
+
+    def E_sums(self, tau, realization_i, a, b, multiplicity_i=None, cumcount_i=None):
+        n_i = realization_i.shape[0]
+        lo = np.searchsorted(realization_i, tau + a, side='right')
+        hi = np.searchsorted(realization_i, tau + b, side='left')
+        if multiplicity_i is None:
+            return hi - lo, hi < n_i
+        if cumcount_i is None:
+            cumcount_i = np.zeros(n_i + 1)
+            np.cumsum(multiplicity_i, out=cumcount_i[1:])
+        return cumcount_i[hi] - cumcount_i[lo], hi < n_i
+
+
+@register_filter
+class GaussianFilter(Filter):
+    """
+    f(t) = exp(-t^2 / (2 sigma^2)) on [-H, H).
+    """
+
+    name = 'gaussian'
+    A_and_I_ij = staticmethod(A_and_I_ij_gauss)
+    E_ijk = staticmethod(E_ijk_gauss)
+
+    @classmethod
+    def default_sigma(cls, half_width):
+        return half_width / 5.
+
+    def get_width(self):
+        return sqrt(2) * self.half_width
+
+    def get_trend_C(self):
+        return self.sigma * sqrt(2 * pi) * erf(self.half_width / (sqrt(2) * self.sigma))
+
+    def get_trend_J(self):
+        return self.sigma ** 2 * 2 * pi * erf(self.half_width / (2 * self.sigma))
+
+    def trend_E(self, a, b):
+        sigma = self.sigma
+        return sigma * sqrt(pi / 2) * (erf(b / (sqrt(2) * sigma)) - erf(a / (sqrt(2) * sigma)))
+
+    def raw_weight_C(self, delta):
+        return np.exp(-.5 * (delta / self.sigma) ** 2)
+
+    def raw_weight_J(self, delta):
+        return self.sigma * sqrt(pi) * np.exp(-.25 * (delta / self.sigma) ** 2)
+
+
+##########
+## Vectorized versions of the estimators
+##########
+
+# The functions below compute all the windows of one pair (i, j) with a few array operations,
+# using the weights of the filters above. They keep the edge conventions of the loops:
+# `side='right'` for the left bound of a window (strict inequality), `side='left'` for its
+# right bound, and the jumps \tau for which \tau + a < 0 or for which no jump of the other
+# node happens after the window are skipped.
+
+def A_ij_rect_sweep(realization_i, realization_j, half_widths, T, L_j, block_size=65536):
+    """
+    Computes `A_ij_rect(realization_i, realization_j, -H, H, T, L_j)` for all the H in
+    `half_widths` in a single pass over the jumps of N^i: the bounds of the nested windows
+    (\tau - H, \tau + H) are located at once, and the counts of all the windows are obtained
+    as differences of these positions.
+    """
+    n_j = realization_j.shape[0]
+    h = np.asarray(half_widths, dtype=float)[np.newaxis, :]
+    rows = max(1, block_size // h.shape[1])
+    res = np.zeros(h.shape[1])
+    n_keep = np.zeros(h.shape[1])
+    for start in range(0, realization_i.shape[0], rows):
+        tau = realization_i[start:start + rows, np.newaxis]
+        u = np.searchsorted(realization_j, tau - h, side='right')
+        v = np.searchsorted(realization_j, tau + h, side='left')
+        keep = (tau - h >= 0) & (v < n_j)
+        res += np.sum((v - u) * keep, axis=0)
+        n_keep += np.sum(keep, axis=0)
+    res -= n_keep * L_j * 2 * h[0]
+    return res / T
+
+
+def A_and_I_ij_vectorized(realization_i, realization_j, half_width, T, L_j, sigma=1.0, filtr='rectangular', n_table=None):
+    """
+    Vectorized version of `A_and_I_ij_rect` and `A_and_I_ij_gauss`.
+    """
+    flt = get_filter(filtr, half_width, sigma, n_table)
+    tau = realization_i[realization_i - half_width >= 0]
+    sum_C, sum_J, keep = flt.C_and_J_sums(tau, realization_j)
+    n_keep = np.count_nonzero(keep)
+    res_C = (np.sum(sum_C[keep]) - n_keep * L_j * flt.trend_C) / T
+    res_J = (np.sum(sum_J[keep]) - n_keep * L_j * flt.trend_J) / T
+    return res_C + res_J * 1j
+
+
+def E_ijk_vectorized(realization_i, realization_j, realization_k, a, b, T, L_i, L_j, J_ij, sigma=1.0, filtr='rectangular', n_table=None):
+    """
+    Vectorized version of `E_ijk_rect` and `E_ijk_gauss`.
+    """
+    flt = get_filter(filtr, max(-a, b), sigma, n_table)
+    trend_E = flt.trend_E(a, b)
+
+    tau = realization_k[realization_k + a >= 0]
+    sum_i, keep_i = flt.E_sums(tau, realization_i, a, b)
+    sum_j, keep_j = flt.E_sums(tau, realization_j, a, b)
+    keep = keep_i & keep_j
+    res = np.dot(sum_i[keep] - L_i * trend_E, sum_j[keep] - L_j * trend_E) - np.count_nonzero(keep) * J_ij
+    return res / T
+
+
+def centered_window_sums(tau, realization, L, flt):
+    """
+    Computes the matrix X of shape (len(tau), d) whose column i holds the centered weighted
+    numbers of jumps of N^i in (\tau - H, \tau + H), that is N^i_{\tau + H} - N^i_{\tau - H} - \Lambda^i (2 H)
+    with the rectangular filter, together with the boolean matrix V telling whether a jump of
+    N^i happens after \tau + H. The entries of X for which V is False are set to zero.
+    """
+    d = len(realization)
+    h_w = flt.half_width
+    trend_E = flt.trend_E(-h_w, h_w)
+    X = np.zeros((tau.shape[0], d))
+    V = np.zeros((tau.shape[0], d), dtype=bool)
+    for i in range(d):
+        realization_i = realization[i]
+        if realization_i.shape[0] == 0: continue
+        sum_E, V[:, i] = flt.E_sums(tau, realization_i, -h_w, h_w)
+        X[:, i] = np.where(V[:, i], sum_E - L[i] * trend_E, 0.)
+    return X, V
+
+
+##########
+## Merged event stream, rectangular filter
+##########
+
+# The jumps of all the nodes are merged into a single time-sorted stream of labelled
+# events, and the windows around \tau are slid along it with one pointer per window bound.
+# The numbers and sums of timestamps of the jumps of every node in the windows are kept up
+# to date as the pointers move, so that each event only costs O(d): the whole day costs
+# O(N d) instead of O(N d log N) for `fused_sums` or O(N d^2) for the loops over pairs.
+
+def merged_stream_sums(times, labels, last, L, half_width, C, J, prod, n_prod, sq, n_sq):
+    """
+    Adds to C, J, prod, n_prod, sq and n_sq the raw sums of `fused_sums` with the rectangular
+    filter, for the merged stream of events `times` (sorted) with node labels `labels`.
+    `last` holds the last jump of every node (-inf when it has none).
+    """
+    n = times.shape[0]
+    d = L.shape[0]
+    width = 2 * half_width
+    # numbers of jumps in [\tau - H, \tau + H) and (\tau - H, \tau + H)
+    count_C = np.zeros(d)
+    count_E = np.zeros(d)
+    # numbers and sums of the jumps in (\tau - 2H, \tau) and [\tau, \tau + 2H)
+    count_left = np.zeros(d)
+    sum_left = np.zeros(d)
+    count_right = np.zeros(d)
+    sum_right = np.zeros(d)
+    X = np.zeros(d)
+    V = np.zeros(d)
+    lo_C = 0
+    lo_E = 0
+    hi = 0
+    lo_J = 0
+    mid = 0
+    hi_J = 0
+    for p in range(n):
+        tau = times[p]
+        while hi < n and times[hi] < tau + half_width:
+            count_C[labels[hi]] += 1
+            count_E[labels[hi]] += 1
+            hi += 1
+        while lo_C < n and times[lo_C] < tau - half_width:
+            count_C[labels[lo_C]] -= 1
+            lo_C += 1
+        while lo_E < n and times[lo_E] <= tau - half_width:
+            count_E[labels[lo_E]] -= 1
+            lo_E += 1
+        while hi_J < n and times[hi_J] < tau + width:
+            count_right[labels[hi_J]] += 1
+            sum_right[labels[hi_J]] += times[hi_J]
+            hi_J += 1
+        while mid < n and times[mid] < tau:
+            count_right[labels[mid]] -= 1
+            sum_right[labels[mid]] -= times[mid]
+            count_left[labels[mid]] += 1
+            sum_left[labels[mid]] += times[mid]
+            mid += 1
+        while lo_J < n and times[lo_J] <= tau - width:
+            count_left[labels[lo_J]] -= 1
+            sum_left[labels[lo_J]] -= times[lo_J]
+            lo_J += 1
+        if tau - half_width < 0:
+            continue
+
+        k = labels[p]
+        for j in range(d):
+            if last[j] >= tau + width:
+                C[k, j] += count_C[j] - L[j] * width
+                J[k, j] += width * (count_left[j] + count_right[j]) + sum_left[j] - tau * count_left[j] \
+                           - sum_right[j] + tau * count_right[j] - L[j] * width ** 2
+            if last[j] >= tau + half_width:
+                V[j] = 1.
+                X[j] = count_E[j] - L[j] * width
+            else:
+                V[j] = 0.
+                X[j] = 0.
+        for j in range(d):
+            prod[j, k] += X[j] * X[k]
+            n_prod[j, k] += V[j] * V[k]
+            sq[k, j] += X[j] * X[j]
+            n_sq[k, j] += V[j]
+
+
+def worker_day_merged(flat, offsets, h_w, T, backend='python'):
+    """
+    Computes L, C, J and E_c of one day with the rectangular filter, given as the flat array
+    of its timestamps and the offsets of its nodes (see `Realizations.flat`), by a single
+    sweep of its merged event stream (see `merged_stream_sums`).
+    """
+    d = offsets.shape[0] - 1
+    counts = np.diff(offsets)
+    L = counts / T
+    labels = np.repeat(np.arange(d, dtype=np.int64), counts)
+    order = np.argsort(flat, kind='stable')
+    last = np.full(d, -np.inf)
+    last[counts > 0] = flat[offsets[1:][counts > 0] - 1]
+    sums = [np.zeros((d, d)) for _ in range(6)]
+    get_kernel(merged_stream_sums, backend)(np.ascontiguousarray(flat[order]), labels[order], last, L, float(h_w), *sums)
+    return (L,) + merge_fused_sums([sums], T)
+
+
+##########
+## Compiled backend for the functions above
+##########
+
+_signatures = {
+    'A_ij_rect': 'float64(float64[:], float64[:], float64, float64, float64, float64)',
+    'A_and_I_ij_rect': 'complex128(float64[:], float64[:], float64, float64, float64, float64)',
+    'A_and_I_ij_gauss': 'complex128(float64[:], float64[:], float64, float64, float64, float64)',
+    'E_ijk_rect': 'float64(float64[:], float64[:], float64[:], float64, float64, float64, float64, float64, float64, float64)',
+    'E_ijk_gauss': 'float64(float64[:], float64[:], float64[:], float64, float64, float64, float64, float64, float64, float64)',
+    'merged_stream_sums': 'void(float64[:], int64[:], float64[:], float64[:], float64, '
+                          'float64[:, :], float64[:, :], float64[:, :], float64[:, :], float64[:, :], float64[:, :])',
+}
+
+_compiled = {}
+
+
+def get_kernel(fun, backend='python'):
+    """
+    Returns the function `fun` itself when `backend` equals `python`, or its Numba nopython
+    version when `backend` equals `numba`. The compiled version releases the GIL, is built on
+    first use and is cached on disk, so that the next sessions skip the compilation.
+    """
+    if backend == 'python':
+        return fun
+    elif backend == 'numba':
+        from numba import jit
+        name = fun.__name__
+        if name not in _compiled:
+            _compiled[name] = jit(_signatures[name], nopython=True, nogil=True, cache=True)(fun)
+        return _compiled[name]
+    else:
+        raise ValueError("In `get_kernel`: `backend` should either equal `python` or `numba`.")
+
+
+def make_day_C_J(kernel):
+    from numba import prange
+    def day_C_J(flat, offsets, ij, h_w, T, L, sigma, C, J):
+        for p in prange(ij.shape[0]):
+            i = ij[p, 0]
+            j = ij[p, 1]
+            if offsets[i + 1] > offsets[i] and offsets[j + 1] > offsets[j]:
+                z = kernel(flat[offsets[i]:offsets[i + 1]], flat[offsets[j]:offsets[j + 1]], h_w, T, L[j], sigma)
+                C[i, j] = z.real
+                J[i, j] = z.imag
+    return day_C_J
+
+
+def make_day_E(kernel):
+    from numba import prange
+    def day_E(flat, offsets, h_w, T, L, J, sigma, E_c):
+        d = offsets.shape[0] - 1
+        for p in prange(d * d):
+            i = p // d
+            j = p % d
+            if offsets[i + 1] > offsets[i] and offsets[j + 1] > offsets[j]:
+                realization_i = flat[offsets[i]:offsets[i + 1]]
+                realization_j = flat[offsets[j]:offsets[j + 1]]
+                E_c[i, j, 0] = kernel(realization_i, realization_j, realization_j, -h_w, h_w, T, L[i], L[j], J[i, j], sigma)
+                E_c[i, j, 1] = kernel(realization_j, realization_j, realization_i, -h_w, h_w, T, L[j], L[j], J[j, j], sigma)
+    return day_E
+
+
+_drivers = {'C_J': make_day_C_J, 'E': make_day_E}
+
+
+def get_threaded_kernel(fun, stage):
+    """
+    Returns the Numba parallel loop over the pairs of a day for the stage `stage` (`C_J` or
+    `E`), calling the compiled version of the kernel `fun` (see `get_kernel`). The loop
+    releases the GIL and reads the timestamps of a day from one flat array (see `Realizations.flat`).
+    """
+    from numba import jit
+    name = fun.__name__ + '_threaded'
+    if name not in _compiled:
+        kernel = get_kernel(fun, 'numba')
+        _compiled[name] = jit(nopython=True, nogil=True, parallel=True)(_drivers[stage](kernel))
+    return _compiled[name]
+
+
+@contextmanager
+def set_threads(n_threads=None):
+    """
+    Sets the number of threads of the Numba parallel loops to `n_threads` (at most
+    NUMBA_NUM_THREADS, all of them by default) during the context, e.g. to leave cores to
+    the BLAS threads of the solver.
+    """
+    import numba
+    previous = numba.get_num_threads()
+    if n_threads is None:
+        n_threads = numba.config.NUMBA_NUM_THREADS
+    numba.set_num_threads(max(1, min(n_threads, numba.config.NUMBA_NUM_THREADS)))
+    try:
+        yield
+    finally:
+        numba.set_num_threads(previous)
+
+
+def check_not_encoded(realizations, fn):
+    # only the fused engine weights the times by their multiplicities
+    if realizations.multiplicities is not None:
+        raise ValueError("In `%s`: run-length encoded realizations are only handled by `compute_fused`, "
+                         "see `Realizations.run_length_encode`." % fn)
+
+
+def pairs(d, symmetric=False):
+    """
+    Iterates over the ordered pairs (i, j), or only over those with i <= j when `symmetric` is True.
+    """
+    if symmetric:
+        return combinations_with_replacement(range(d), 2)
+    return product(range(d), repeat=2)
+
+
+@contextmanager
+def shared_realizations(realizations, folder=None):
+    """
+    Writes the buffer of the `Realizations` `realizations` once in a memory-mapped file of
+    the temporary folder `folder`, and yields this memmap together with the array of offsets
+    of shape (n_realizations, dim + 1): node i of day `day` is
+    flat[offsets[day, i]:offsets[day, i + 1]]. joblib sends a memmap to its workers as a
+    reference to the file, so that the jobs only receive offsets and indices.
+    The file is removed on exit.
+    """
+    realizations = Realizations.from_lists(realizations)
+    start, end = realizations.offsets[0, 0], realizations.offsets[-1, -1]
+    offsets = realizations.offsets - start
+    folder = mkdtemp(dir=folder)
+    try:
+        filename = os.path.join(folder, 'realizations.dat')
+        flat = np.memmap(filename, dtype=np.float64, mode='w+', shape=(max(int(end - start), 1),))
+        flat[:end - start] = realizations.data[start:end]
+        flat.flush()
+        del flat
+        # copy-on-write mode keeps the slices writable, as required by the compiled kernels
+        yield np.memmap(filename, dtype=np.float64, mode='c'), offsets
+    finally:
+        rmtree(folder, ignore_errors=True)
+
+
+def worker_nodes(fun, flat, offsets, nodes, *args):
+    """
+    Calls `fun` on the timestamps of the nodes `nodes` of the day whose offsets in the flat
+    array `flat` are `offsets` (see `shared_realizations`), followed by `args`.
+    """
+    return fun(*[np.asarray(flat[offsets[i]:offsets[i + 1]]) for i in nodes], *args)
+
+
+def screen_pairs(realization, bin_size, threshold=0.05):
+    """
+    Returns the boolean matrix of the pairs (i, j) whose numbers of jumps in the consecutive
+    bins of length `bin_size` have a correlation larger than `threshold` in absolute value,
+    the diagonal included. This costs O(N + n_bins d^2), with n_bins = T / bin_size.
+    """
+    d = len(realization)
+    start = min(x[0] for x in realization if len(x) > 0)
+    end = max(x[-1] for x in realization if len(x) > 0)
+    n_bins = int((end - start) // bin_size) + 1
+    B = np.zeros((n_bins, d))
+    for i, realization_i in enumerate(realization):
+        B[:, i] = np.bincount(((realization_i - start) // bin_size).astype(np.int64), minlength=n_bins)
+    B -= B.mean(axis=0)
+    norms = np.sqrt(np.einsum('ti,ti->i', B, B))
+    norms[norms == 0] = np.inf
+    corr = np.dot(B.T, B) / np.outer(norms, norms)
+    mask = np.abs(corr) >= threshold
+    mask |= mask.T
+    np.fill_diagonal(mask, True)
+    return mask
+
+
+def worker_day_sparse(A_and_I_ij, E_ijk, realization, h_w, T, L, sigma, rows, cols):
+    """
+    Computes C, J, E_c[..., 0] and E_c[..., 1] of one realization on the pairs (rows[p], cols[p])
+    only, the set of pairs being symmetric and containing the diagonal, as CSR matrices.
+    """
+    from scipy.sparse import coo_matrix, csr_matrix
+    d = len(realization)
+    n = np.array([len(x) for x in realization])
+    z = np.zeros(rows.shape[0], dtype=complex)
+    for p, (i, j) in enumerate(zip(rows, cols)):
+        if n[i] * n[j] != 0:
+            z[p] = A_and_I_ij(realization[i], realization[j], h_w, T, L[j], sigma)
+    C = csr_matrix(coo_matrix((z.real, (rows, cols)), shape=(d, d)))
+    J = csr_matrix(coo_matrix((z.imag, (rows, cols)), shape=(d, d)))
+    # we keep the symmetric part to remove edge effects
+    C = 0.5 * (C + C.T)
+    J = 0.5 * (J + J.T)
+    J_ij = np.asarray(J[rows, cols]).ravel()
+    J_diag = J.diagonal()
+    E_0 = np.zeros(rows.shape[0])
+    E_1 = np.zeros(rows.shape[0])
+    for p, (i, j) in enumerate(zip(rows, cols)):
+        if n[i] * n[j] != 0:
+            E_0[p] = E_ijk(realization[i], realization[j], realization[j], -h_w, h_w, T, L[i], L[j], J_ij[p], sigma)
+            E_1[p] = E_ijk(realization[j], realization[j], realization[i], -h_w, h_w, T, L[j], L[j], J_diag[j], sigma)
+    E_0 = csr_matrix(coo_matrix((E_0, (rows, cols)), shape=(d, d)))
+    E_1 = csr_matrix(coo_matrix((E_1, (rows, cols)), shape=(d, d)))
+    return C, J, E_0, E_1
+
+
+def worker_day_C_J(fun, realization, h_w, T, L, sigma, d, symmetric=False):
     C = np.zeros((d, d))
     J = np.zeros((d, d))
-    for i, j in product(range(d), repeat=2):
+    for i, j in pairs(d, symmetric):
         if len(realization[i])*len(realization[j]) != 0:
             z = fun(realization[i], realization[j], h_w, T, L[j], sigma)
             C[i,j] = z.real
             J[i,j] = z.imag
+            if symmetric:
+                C[j,i] = z.real
+                J[j,i] = z.imag
     return C + J * 1j
 
+def worker_day_C_J_E(A_and_I_ij, E_ijk, realization, h_w, T, L, sigma, d, symmetric=False):
+    # both stages of `parallel_by_day` on one day, C and J being symmetrized before E_c
+    z = worker_day_C_J(A_and_I_ij, realization, h_w, T, L, sigma, d, symmetric)
+    C = 0.5 * (z.real + z.real.T)
+    J = 0.5 * (z.imag + z.imag.T)
+    return C, J, worker_day_E(E_ijk, realization, h_w, T, L, J, sigma, d)
+
 def worker_day_E(fun, realization, h_w, T, L, J, sigma, d):
     E_c = np.zeros((d, d, 2))
     for i, j in product(range(d), repeat=2):
@@ -634,3 +1966,244 @@ def worker_day_E(fun, realization, h_w, T, L, J, sigma, d):
             E_c[i, j, 1] = fun(realization[j], realization[j], realization[i], -h_w, h_w,
                                   T, L[j], L[j], J[j, j], sigma)
     return E_c
+
+def worker_day_fused(realization, h_w, T, flt, block_size=65536, multiplicity=None):
+    """
+    Computes L, C, J and E_c of one realization with the filter `flt`.
+    For each reference node k, the jumps of every node j are located once around the jumps
+    of k, and give at the same time C[k, j], J[k, j] and the window sums used by E_c[:, k, 0]
+    and E_c[k, :, 1] (see `worker_day_E_window_counts`).
+    The terms of E_c involving J are added at the end, once J is symmetrized.
+    `multiplicity` gives the multiplicities of the times of a run-length encoded realization.
+    """
+    if multiplicity is None:
+        n = np.array([x.shape[0] for x in realization])
+    else:
+        n = np.array([np.sum(m) for m in multiplicity])
+    L = n / T
+    sums = fused_sums(realization, realization, h_w, L, flt, block_size, multiplicity, multiplicity)
+    return (L,) + merge_fused_sums([sums], T)
+
+
+def fused_sums(realization, reference, h_w, L, flt, block_size=65536, multiplicity=None, reference_multiplicity=None):
+    """
+    Computes the raw sums of `worker_day_fused` over the jumps \tau of `reference` (a list of
+    d arrays, subsets of the jumps of `realization`), before the division by T and the
+    symmetrization: C, J, prod, n_prod, sq and n_sq, see `merge_fused_sums`.
+    These sums are additive over disjoint sets of reference jumps.
+    For run-length encoded realizations, `multiplicity` and `reference_multiplicity` hold
+    the multiplicities of the times of `realization` and `reference`: the terms of each
+    distinct time are then weighted by its multiplicity, which gives the same sums as the
+    repeated times.
+    """
+    d = len(realization)
+    n = np.array([x.shape[0] for x in realization])
+    trend_E = flt.trend_E(-h_w, h_w)
+    cumsums = []
+    cumcounts = []
+    for j, realization_j in enumerate(realization):
+        cumsum_j = np.zeros(realization_j.shape[0] + 1)
+        if multiplicity is None:
+            np.cumsum(realization_j, out=cumsum_j[1:])
+            cumcounts.append(None)
+        else:
+            np.cumsum(realization_j * multiplicity[j], out=cumsum_j[1:])
+            cumcount_j = np.zeros(realization_j.shape[0] + 1)
+            np.cumsum(multiplicity[j], out=cumcount_j[1:])
+            cumcounts.append(cumcount_j)
+        cumsums.append(cumsum_j)
+
+    C = np.zeros((d, d))
+    J = np.zeros((d, d))
+    prod = np.zeros((d, d))
+    n_prod = np.zeros((d, d))
+    sq = np.zeros((d, d))
+    n_sq = np.zeros((d, d))
+    for k in range(d):
+        realization_k = reference[k]
+        started = realization_k - h_w >= 0
+        realization_k = realization_k[started]
+        if reference_multiplicity is not None:
+            multiplicity_k = np.asarray(reference_multiplicity[k], dtype=float)[started]
+        for start in range(0, realization_k.shape[0], block_size):
+            tau = realization_k[start:start + block_size]
+            X = np.zeros((tau.shape[0], d))
+            V = np.zeros((tau.shape[0], d))
+            if reference_multiplicity is None:
+                w = None
+            else:
+                w = multiplicity_k[start:start + block_size]
+            for j in range(d):
+                realization_j = realization[j]
+                if n[j] == 0: continue
+                multiplicity_j = None if multiplicity is None else multiplicity[j]
+
+                # C and J, see `A_and_I_ij_vectorized`
+                sum_C, sum_J, keep = flt.C_and_J_sums(tau, realization_j, cumsums[j], multiplicity_j, cumcounts[j])
+                if w is None:
+                    n_keep = np.count_nonzero(keep)
+                    C[k, j] += np.sum(sum_C[keep]) - n_keep * L[j] * flt.trend_C
+                    J[k, j] += np.sum(sum_J[keep]) - n_keep * L[j] * flt.trend_J
+                else:
+                    n_keep = np.sum(w[keep])
+                    C[k, j] += np.dot(w[keep], sum_C[keep]) - n_keep * L[j] * flt.trend_C
+                    J[k, j] += np.dot(w[keep], sum_J[keep]) - n_keep * L[j] * flt.trend_J
+
+                # window sums for E_c, see `centered_window_sums`
+                sum_E, valid = flt.E_sums(tau, realization_j, -h_w, h_w, multiplicity_j, cumcounts[j])
+                V[:, j] = valid
+                X[:, j] = np.where(valid, sum_E - L[j] * trend_E, 0.)
+
+            if w is None:
+                prod[:, k] += np.dot(X.T, X[:, k])
+                n_prod[:, k] += np.dot(V.T, V[:, k])
+                sq[k] += np.einsum('ti,ti->i', X, X)
+                n_sq[k] += np.sum(V, axis=0)
+            else:
+                prod[:, k] += np.dot(X.T, w * X[:, k])
+                n_prod[:, k] += np.dot(V.T, w * V[:, k])
+                sq[k] += np.einsum('t,ti,ti->i', w, X, X)
+                n_sq[k] += np.dot(w, V)
+    return C, J, prod, n_prod, sq, n_sq
+
+
+def merge_fused_sums(l, T):
+    """
+    Adds up the raw sums of `fused_sums` given in the list `l`, and returns C, J and E_c.
+    """
+    C, J, prod, n_prod, sq, n_sq = [np.sum(z, axis=0) for z in zip(*l)]
+    d = C.shape[0]
+    C /= T
+    J /= T
+    # we keep the symmetric part to remove edge effects
+    C = 0.5 * (C + C.T)
+    J = 0.5 * (J + J.T)
+    E_c = np.zeros((d, d, 2))
+    E_c[:, :, 0] = (prod - J * n_prod) / T
+    E_c[:, :, 1] = (sq - np.diag(J)[np.newaxis, :] * n_sq) / T
+    return C, J, E_c
+
+
+def time_blocks(realization, h_w, flt, n_blocks):
+    """
+    Splits one realization into `n_blocks` consecutive time intervals [s, e) of equal length.
+    Yields, for each interval, the jumps of every node in [s, e), used as reference jumps, and
+    the jumps of every node in the halo [s - W, e + W] with W = max(width, H), extended by the
+    first jump after it. The halo contains all the jumps seen by the windows of the reference
+    jumps, and the extra jump keeps the test `a jump of N^j happens after the window` exact.
+    """
+    halo = max(flt.width, h_w)
+    first = min(x[0] for x in realization if x.shape[0] > 0)
+    last = max(x[-1] for x in realization if x.shape[0] > 0)
+    bounds = np.linspace(first, last, n_blocks + 1)
+    bounds[-1] = np.inf
+    for s, e in zip(bounds[:-1], bounds[1:]):
+        reference = []
+        local = []
+        for realization_j in realization:
+            lo, hi = np.searchsorted(realization_j, [s, e], side='left')
+            reference.append(realization_j[lo:hi])
+            lo = np.searchsorted(realization_j, s - halo, side='left')
+            hi = np.searchsorted(realization_j, e + halo, side='right')
+            local.append(realization_j[lo:hi + 1])
+        yield local, reference
+
+
+def worker_day_lazy(realization, h_w, flt):
+    T = get_time(realization)
+    return (T,) + worker_day_fused(realization, h_w, T, flt)
+
+
+def worker_day_sweep(realization, half_widths, T, block_size=65536):
+    """
+    Same as `worker_day_fused` with the rectangular filter, for all the half widths of the
+    array `half_widths` at once. The rectangular filter is built with the whole array as
+    half width, so that its window sums are computed for every H by broadcasting, and the
+    jumps of the realization are traversed only once.
+    Returns L of shape (d,), C and J of shape (n_H, d, d) and E_c of shape (n_H, d, d, 2).
+    """
+    d = len(realization)
+    h = np.asarray(half_widths, dtype=float)[np.newaxis, :]
+    n_H = h.shape[1]
+    rows = max(1, block_size // n_H)
+    flt = RectangularFilter(h)
+    trend_E = flt.trend_E(-h, h)[0]
+    n = np.array([x.shape[0] for x in realization])
+    L = n / T
+    cumsums = []
+    for realization_j in realization:
+        cumsum_j = np.zeros(realization_j.shape[0] + 1)
+        np.cumsum(realization_j, out=cumsum_j[1:])
+        cumsums.append(cumsum_j)
+
+    C = np.zeros((n_H, d, d))
+    J = np.zeros((n_H, d, d))
+    prod = np.zeros((n_H, d, d))
+    n_prod = np.zeros((n_H, d, d))
+    sq = np.zeros((n_H, d, d))
+    n_sq = np.zeros((n_H, d, d))
+    for k in range(d):
+        realization_k = realization[k]
+        realization_k = realization_k[realization_k - h.min() >= 0]
+        for start in range(0, realization_k.shape[0], rows):
+            tau = realization_k[start:start + rows, np.newaxis]
+            started = tau - h >= 0
+            X = np.zeros((tau.shape[0], d, n_H))
+            V = np.zeros((tau.shape[0], d, n_H))
+            for j in range(d):
+                realization_j = realization[j]
+                if n[j] == 0: continue
+
+                sum_C, sum_J, keep = flt.C_and_J_sums(tau, realization_j, cumsums[j])
+                keep &= started
+                n_keep = np.sum(keep, axis=0)
+                C[:, k, j] += np.sum(sum_C * keep, axis=0) - n_keep * L[j] * flt.trend_C[0]
+                J[:, k, j] += np.sum(sum_J * keep, axis=0) - n_keep * L[j] * flt.trend_J[0]
+
+                sum_E, valid = flt.E_sums(tau, realization_j, -h, h)
+                valid &= started
+                V[:, j] = valid
+                X[:, j] = np.where(valid, sum_E - L[j] * trend_E, 0.)
+
+            prod[:, :, k] += np.einsum('tih,th->hi', X, X[:, k])
+            n_prod[:, :, k] += np.einsum('tih,th->hi', V, V[:, k])
+            sq[:, k] += np.einsum('tih,tih->hi', X, X)
+            n_sq[:, k] += np.sum(V, axis=0).T
+
+    C /= T
+    J /= T
+    # we keep the symmetric part to remove edge effects
+    C = 0.5 * (C + C.transpose(0, 2, 1))
+    J = 0.5 * (J + J.transpose(0, 2, 1))
+    diag_J = np.diagonal(J, axis1=1, axis2=2)[:, np.newaxis, :]
+    E_c = np.zeros((n_H, d, d, 2))
+    E_c[..., 0] = (prod - J * n_prod) / T
+    E_c[..., 1] = (sq - diag_J * n_sq) / T
+    return L, C, J, E_c
+
+
+def worker_day_E_window_counts(realization, h_w, T, L, J, d, flt, block_size=65536):
+    """
+    Same result as `worker_day_E` with the `E_ijk` of the filter `flt`, but the window sums of
+    every node around the jumps of a reference node k are computed once and shared by all the
+    entries of E_c whose reference node is k: E_c[:, k, 0] and E_c[k, :, 1].
+    The jumps of node k are processed by blocks of `block_size` to bound the memory.
+    """
+    E_c = np.zeros((d, d, 2))
+    for k in range(d):
+        realization_k = realization[k]
+        realization_k = realization_k[realization_k - h_w >= 0]
+        prod_k = np.zeros(d)
+        sq = np.zeros(d)
+        n_prod_k = np.zeros(d)
+        n_sq = np.zeros(d)
+        for start in range(0, realization_k.shape[0], block_size):
+            tau = realization_k[start:start + block_size]
+            X, V = centered_window_sums(tau, realization, L, flt)
+            prod_k += np.dot(X.T, X[:, k])
+            sq += np.einsum('ti,ti->i', X, X)
+            n_prod_k += np.dot(V.T, V[:, k].astype(float))
+            n_sq += np.sum(V, axis=0)
+        E_c[:, k, 0] = (prod_k - J[:, k] * n_prod_k) / T
+        E_c[k, :, 1] = (sq - np.diag(J) * n_sq) / T
+    return E_c
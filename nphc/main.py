@@ -1,14 +1,13 @@
 from nphc.cumulants import Cumulants
 from nphc.utils.loader import load_data
-from scipy.linalg import inv, qr, sqrtm, norm
 from itertools import product
-import tensorflow as tf
 import numpy as np
 
-import tensorflow.compat.v1 as tf
-tf.disable_v2_behavior()
+# scipy and TensorFlow are imported by the functions which use them: fitting the cumulants,
+# or solving with `backend='numpy'`, does not load TensorFlow
 
 def starting_point(cumulants_list,random=False):
+    from scipy.linalg import sqrtm
     L_list, C_list, K_c_list = cumulants_list
     d = len(L_list[0])
     sqrt_C = sqrtm(np.mean(C_list,axis=0))
@@ -20,11 +19,110 @@ def starting_point(cumulants_list,random=False):
     initial = np.dot(np.dot(sqrt_C,M),np.diag(1./sqrt_L))
     return initial
 
+def to_dense(X):
+    # the cumulants computed with `method='sparse'` are scipy.sparse matrices
+    from scipy.sparse import issparse
+    if issparse(X):
+        return X.toarray()
+    return np.asarray(X)
+
 def random_orthogonal_matrix(dim):
+    from scipy.linalg import qr
     M = np.random.rand(dim**2).reshape(dim, dim)
     Q, _ = qr(M)
     return Q
 
+def objective(R, L, C, K_c, alpha, l_l1=0., l_l2=0., L_avg=None, l_mu=0.):
+    """
+    Returns the cost minimized by `NPHC.solve` and its gradient with respect to R, computed
+    in closed form. L, C and K_c are the cumulants of one realization, shape=(dim,) and
+    (dim, dim), or of several ones stacked, shape=(n, dim) and (n, dim, dim): the cost is then
+    the average of the costs of the realizations. With `L_avg`, the penalty of
+    `positive_baselines` is added.
+    """
+    from scipy.linalg import inv
+    L = np.atleast_2d(L)
+    C = C.reshape((-1,) + C.shape[-2:])
+    K_c = K_c.reshape((-1,) + K_c.shape[-2:])
+    n, d = L.shape
+    T = lambda X: np.swapaxes(X, -1, -2)
+    R_D = R * L[:, np.newaxis, :]
+    S = R * R
+    P = R * C
+    activation_2 = np.matmul(R_D, R.T)
+    activation_3 = np.matmul(C, S.T) + 2. * np.matmul(R, T(P)) - 2. * np.matmul(R_D, S.T)
+    G_2 = alpha * 2. / d ** 2 * (activation_2 - C)
+    G_3 = (1 - alpha) * 2. / d ** 2 * (activation_3 - K_c)
+    cost = alpha * np.mean((activation_2 - C) ** 2) + (1 - alpha) * np.mean((activation_3 - K_c) ** 2)
+    grad = np.matmul(G_2 + T(G_2), R_D) \
+           + 2. * R * np.matmul(T(G_3), C) \
+           + 2. * (np.matmul(G_3, P) + C * np.matmul(T(G_3), R)) \
+           - 2. * (np.matmul(G_3, S) * L[:, np.newaxis, :] + 2. * R * np.matmul(T(G_3), R_D))
+    grad = grad.mean(axis=0)
+    if l_l1 > 0 or l_l2 > 0 or L_avg is not None:
+        R_inv = inv(R)
+    if l_l1 > 0 or l_l2 > 0:
+        M = np.eye(d) - R_inv
+        cost += l_l1 * np.sum(np.abs(M)) + l_l2 * np.sum(M ** 2)
+        G_M = l_l1 * np.sign(M) + 2. * l_l2 * M
+        grad += np.dot(R_inv.T, np.dot(G_M, R_inv.T))
+    if L_avg is not None:
+        neg_baselines = - np.dot(R_inv, L_avg)
+        cost += l_mu * np.sum(np.maximum(neg_baselines, 0.))
+        G_b = l_mu * (neg_baselines > 0)
+        grad += np.dot(R_inv.T, np.dot(np.outer(G_b, L_avg), R_inv.T))
+    return cost, grad
+
+def epoch_batches(n_realizations, full_batch=False, batch_size=None):
+    """
+    Returns the batches of realizations descended in one epoch of `NPHC.solve`: all of them
+    with `full_batch`, a random permutation of them cut in batches of `batch_size` (the last
+    one may be smaller) with `batch_size`, or else a single realization drawn at random.
+    """
+    if full_batch:
+        return [slice(None)]
+    if batch_size is not None:
+        order = np.random.permutation(n_realizations)
+        return [order[start:start + batch_size] for start in range(0, n_realizations, batch_size)]
+    i = np.random.randint(0, n_realizations)
+    return [slice(i, i + 1)]
+
+def numpy_optimizer(optimizer, learning_rate):
+    """
+    Returns the function step(R, grad) of the optimizer `optimizer`, which returns the next
+    iterate. The updates and the default parameters are those of the TensorFlow optimizers
+    used by `NPHC.solve`, so that both backends follow the same path.
+    """
+    state = {'t': 0}
+    def step(R, grad):
+        state['t'] += 1
+        t = state['t']
+        if optimizer == 'momentum':
+            state['accum'] = 0.9 * state.get('accum', 0.) + grad
+            return R - learning_rate * state['accum']
+        elif optimizer == 'adam':
+            beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+            state['m'] = beta1 * state.get('m', 0.) + (1 - beta1) * grad
+            state['v'] = beta2 * state.get('v', 0.) + (1 - beta2) * grad ** 2
+            lr = learning_rate * np.sqrt(1 - beta2 ** t) / (1 - beta1 ** t)
+            return R - lr * state['m'] / (np.sqrt(state['v']) + epsilon)
+        elif optimizer == 'adagrad':
+            state['accum'] = state.get('accum', 0.1) + grad ** 2
+            return R - learning_rate * grad / np.sqrt(state['accum'])
+        elif optimizer == 'rmsprop':
+            decay, epsilon = 0.9, 1e-10
+            state['ms'] = decay * state.get('ms', 1.) + (1 - decay) * grad ** 2
+            return R - learning_rate * grad / np.sqrt(state['ms'] + epsilon)
+        elif optimizer == 'adadelta':
+            rho, epsilon = 0.95, 1e-8
+            state['accum'] = rho * state.get('accum', 0.) + (1 - rho) * grad ** 2
+            update = np.sqrt(state.get('accum_update', 0.) + epsilon) / np.sqrt(state['accum'] + epsilon) * grad
+            state['accum_update'] = rho * state.get('accum_update', 0.) + (1 - rho) * update ** 2
+            return R - learning_rate * update
+        else:
+            return R - learning_rate * grad
+    return step
+
 
 class NPHC(object):
     """
@@ -64,7 +162,8 @@ class NPHC(object):
         # we will store here the optimal cost reached
         self.optcost = None
 
-    def fit(self, realizations=[], half_width=100., filtr='rectangular', method="parallel", mu_true=None, R_true=None):
+    def fit(self, realizations=[], half_width=100., filtr='rectangular', method="parallel", mu_true=None, R_true=None,
+            cache_dir=None, keep='all'):
         """
         Set the corresponding realization(s) of the process.
         Compute the cumulants.
@@ -72,22 +171,32 @@ class NPHC(object):
         Parameters
         ----------
 
-            realizations : `list`
-                * Either a single realization as a list of np_arrays each representing
+            realizations : `Realizations`, `list` or iterable
+                * Either a `Realizations`, see `nphc.realizations`
+                * Or a single realization as a list of np_arrays each representing
                 the time stamps of a node of the Hawkes process
                 * Or a list of realizations represented as above.
+                * Or any iterable of realizations, e.g. a generator loading them from disk:
+                they are then consumed a few at a time, see `Cumulants`.
 
-        """
-        if all(isinstance(x,list) for x in realizations):
-            self.realizations = realizations
-        else:
-            self.realizations = [realizations]
+            With `method='sparse'`, C and K_c are sparse matrices, which `solve` accepts.
+
+            cache_dir : `str`
+                Folder of the on-disk cache of the cumulants (see `Cumulants.compute_cumulants`):
+                fitting the same realizations again then loads the cumulants instead of computing them.
 
-        cumul = Cumulants(realizations, half_width=half_width)
+            keep : `str`
+                `all` keeps the cumulants of every realization, `mean` only their averages
+                (see `Cumulants`), which `solve` then uses as a single realization.
+
+            The realizations are not kept, only their cumulants.
+        """
+        cumul = Cumulants(realizations, half_width=half_width, keep=keep)
         cumul.mu_true = mu_true
         cumul.R_true = R_true
-        cumul.compute_cumulants(half_width,filtr=filtr,method=method,sigma=half_width/5.)
+        cumul.compute_cumulants(half_width,filtr=filtr,method=method,sigma=half_width/5.,cache_dir=cache_dir)
 
+        self.n_realizations = len(cumul.L)
         self.L = cumul.L.copy()
         self.C = cumul.C.copy()
         self.K_c = cumul.K_c.copy()
@@ -102,7 +211,8 @@ class NPHC(object):
 
 
     def solve(self, alpha=-1, l_l1=0., l_l2=0., initial_point=None, training_epochs=1000, learning_rate=1e6, optimizer='momentum', \
-         display_step = 100, use_average=False, use_projection=False, projection_stable_G=False, positive_baselines=False, l_mu=0.):
+         display_step = 100, use_average=False, use_projection=False, projection_stable_G=False, positive_baselines=False, l_mu=0.,
+         backend='tensorflow', full_batch=False, batch_size=None):
         """
 
         Parameters
@@ -116,39 +226,78 @@ class NPHC(object):
 
             optimizer : `str`
                 The optimizer used to minimize the objective function. We use optimizers from TensorFlow.
+                With `backend='numpy'`, `lbfgs` runs SciPy's L-BFGS-B, for `training_epochs`
+                iterations, on the average cumulants if `use_average` else on all the realizations.
+
+            backend : `str`
+                `tensorflow` builds the graph of the cost, `numpy` uses its closed-form gradient
+                (see `objective`) and NumPy versions of the same optimizers, without TensorFlow.
+
+            full_batch : `bool`
+                Each step descends the average of the costs of all the realizations, instead of
+                the cost of one realization drawn at random (or of the average cumulants, with
+                `use_average`).
+
+            batch_size : `int`
+                Mini-batch mode: each epoch shuffles the realizations and takes one step per batch
+                of `batch_size` of them, on the average of their costs, so that every realization
+                is used once per epoch. The projection of `projection_stable_G` is applied at the
+                end of each epoch, that of `use_projection` after each step.
+
+        The cumulants of the realizations are stacked, and the cost is evaluated on all of them
+        in one call, both to display it and for `full_batch`.
         """
+        if backend not in ('tensorflow', 'numpy'):
+            raise ValueError("In `solve`: `backend` should either equal `tensorflow` or `numpy`.")
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("In `solve`: `batch_size` should be a positive integer.")
+        from scipy.linalg import inv, sqrtm, norm
+
+        L_list = np.asarray(self.L)
+        C_list = np.array([to_dense(C) for C in self.C])
+        K_c_list = np.array([to_dense(K_c) for K_c in self.K_c])
 
         if use_projection:
             self.alpha = 0.
         elif alpha == -1:
-            self.alpha = 1./(1. + (norm(np.mean([C for C in self.C],axis=0))**2) / (norm(np.mean([K_c for K_c in self.K_c],axis=0))**2) )
+            self.alpha = 1./(1. + (norm(np.mean(C_list,axis=0))**2) / (norm(np.mean(K_c_list,axis=0))**2) )
         else:
             self.alpha = alpha
 
         self.l_l1 = l_l1
         self.l_l2 = l_l2
 
-        cumulants_list = [self.L, self.C, self.K_c]
+        cumulants_list = [self.L, C_list, K_c_list]
         d = len(self.L[0])
         if initial_point is None:
             start_point = starting_point(cumulants_list, random=False)
         else:
             start_point = initial_point.copy()
 
+        if backend == 'numpy':
+            return self.solve_numpy(start_point, C_list, K_c_list, training_epochs, learning_rate, optimizer, display_step,
+                                    use_average, use_projection, projection_stable_G, positive_baselines, l_mu, full_batch,
+                                    batch_size)
+
+        import tensorflow.compat.v1 as tf
+        tf.disable_v2_behavior()
+
         R0 = tf.constant(start_point.astype(np.float64), shape=[d,d])
-        L = tf.placeholder(tf.float64, d, name='L')
-        C = tf.placeholder(tf.float64, (d,d), name='C')
-        K_c = tf.placeholder(tf.float64, (d,d), name='K_c')
+        # the cumulants of a batch of realizations, stacked
+        L = tf.placeholder(tf.float64, (None,d), name='L')
+        C = tf.placeholder(tf.float64, (None,d,d), name='C')
+        K_c = tf.placeholder(tf.float64, (None,d,d), name='K_c')
 
         R = tf.Variable(R0, name='R', dtype=tf.float64)
 
         #I = tf.diag(tf.ones(d,dtype=tf.float64))
-        I = tf.Variable(initial_value=np.eye(d), dtype=tf.float64)
+        I = tf.constant(np.eye(d), dtype=tf.float64)
 
-        # Construct model
-        activation_3 = tf.matmul(C,tf.square(R),transpose_b=True) + 2.0*tf.matmul(R,R*C,transpose_b=True) \
-                       - 2.0*tf.matmul(R,tf.matmul(tf.diag(L),tf.square(R),transpose_b=True))
-        activation_2 = tf.matmul(R,tf.matmul(tf.diag(L),R,transpose_b=True))
+        # Construct model, for each realization of the batch: R_D = R diag(L)
+        R_D = R * tf.expand_dims(L, 1)
+        activation_3 = tf.einsum('nik,jk->nij', C, tf.square(R)) + 2.0*tf.einsum('ik,njk->nij', R, R*C) \
+                       - 2.0*tf.einsum('nik,jk->nij', R_D, tf.square(R))
+        activation_2 = tf.einsum('nik,jk->nij', R_D, R)
 
         cost =  (1-self.alpha) * tf.reduce_mean( tf.squared_difference( activation_3, K_c ) ) \
         + self.alpha * tf.reduce_mean( tf.squared_difference( activation_2, C ) )
@@ -168,16 +317,14 @@ class NPHC(object):
         # always use the average cumulants over all realizations
         if use_average or use_projection or projection_stable_G or positive_baselines:
             L_avg = np.mean(self.L, axis=0)
-            C_avg = np.mean(self.C, axis=0)
-            K_avg = np.mean(self.K_c, axis=0)
+            C_avg = np.mean(C_list, axis=0)
+            K_avg = np.mean(K_c_list, axis=0)
         if use_projection:
             L_avg_sqrt = np.sqrt(L_avg)
             L_avg_sqrt_inv = 1./L_avg_sqrt
-            from scipy.linalg import inv, sqrtm
             C_avg_sqrt = sqrtm(C_avg)
             C_avg_sqrt_inv = inv(C_avg_sqrt)
         if projection_stable_G or positive_baselines:
-            from scipy.linalg import inv
             C_avg_inv = inv(C_avg)
 
         if positive_baselines:
@@ -199,6 +346,22 @@ class NPHC(object):
         else:
             optimizer = tf.train.GradientDescentOptimizer(learning_rate).minimize(cost)
 
+        # the projections are ops of the graph, built once: U diag(S) V^T = tf.linalg.svd(X) gives S, U, V
+        train_step = optimizer
+        if use_projection and not use_average:
+            # R diag(sqrt(L)) is projected on C^{1/2} times the orthogonal matrices, after each step
+            with tf.control_dependencies([optimizer]):
+                # read inside the block, so that the projection sees the R updated by the step
+                R_new = R.read_value()
+                to_be_projected = tf.matmul(C_avg_sqrt_inv, R_new * L_avg_sqrt)
+                S, U, V = tf.linalg.svd(to_be_projected)
+                train_step = R.assign(tf.matmul(C_avg_sqrt, tf.matmul(U, V, adjoint_b=True)) * L_avg_sqrt_inv).op
+        if projection_stable_G:
+            to_be_projected = np.eye(d) - tf.matmul(L_avg.reshape(d,1) * tf.transpose(R), C_avg_inv)
+            S, U, V = tf.linalg.svd(to_be_projected)
+            G_projected = tf.matmul(U * tf.minimum(S, .99), V, adjoint_b=True)
+            project_stable_G = R.assign(tf.matmul(C_avg, np.eye(d) - tf.transpose(G_projected)) / L_avg).op
+
         # Initialize the variables
         init = tf.global_variables_initializer()
 
@@ -213,35 +376,19 @@ class NPHC(object):
             for epoch in range(training_epochs):
 
                 if epoch % display_step == 0:
-                    avg_cost = np.average([sess.run(cost, feed_dict={L: L_, C: C_, K_c: K_c_})
-                                           for (L_, C_, K_c_) in zip(self.L, self.C, self.K_c)])
+                    avg_cost = sess.run(cost, feed_dict={L: L_list, C: C_list, K_c: K_c_list})
                     print("Epoch:", '%04d' % (epoch), "log10(cost)=", "{:.9f}".format(np.log10(avg_cost)))
 
                 if use_average:
-                    sess.run(optimizer, feed_dict={L: L_avg, C: C_avg, K_c: K_avg})
+                    sess.run(train_step, feed_dict={L: L_avg[np.newaxis], C: C_avg[np.newaxis], K_c: K_avg[np.newaxis]})
 
-                elif use_projection:
-                    # Fit training using batch data
-                    i = np.random.randint(0,len(self.realizations))
-                    sess.run(optimizer, feed_dict={L: self.L[i], C: self.C[i], K_c: self.K_c[i]})
-                    to_be_projected = np.dot(C_avg_sqrt_inv,np.dot(sess.run(R),np.diag(L_avg_sqrt)))
-                    U, S, V = np.linalg.svd(to_be_projected)
-                    R_projected = np.dot( C_avg_sqrt, np.dot( np.dot(U,V), np.diag(L_avg_sqrt_inv) ) )
-                    assign_op = R.assign(R_projected)
-                    sess.run(assign_op)
                 else:
                     # Fit training using batch data
-                    i = np.random.randint(0,len(self.realizations))
-                    sess.run(optimizer, feed_dict={L: self.L[i], C: self.C[i], K_c: self.K_c[i]})
+                    for batch in epoch_batches(self.n_realizations, full_batch, batch_size):
+                        sess.run(train_step, feed_dict={L: L_list[batch], C: C_list[batch], K_c: K_c_list[batch]})
 
                 if projection_stable_G:
-                    to_be_projected = np.eye(d) - np.dot( np.dot(np.diag(L_avg), sess.run(tf.transpose(R))), C_avg_inv)
-                    U, S, V = np.linalg.svd(to_be_projected)
-                    S[S >= .99] = .99
-                    G_projected = np.dot( U, np.dot(np.diag(S), V) )
-                    R_projected = np.dot(C_avg, np.dot( np.eye(d) - G_projected.T, np.diag(1./L_avg) ) )
-                    assign_op = R.assign(R_projected)
-                    sess.run(assign_op)
+                    sess.run(project_stable_G)
 
                 # Write logs at every iteration
                 #summary_str = sess.run(merged_summary_op, feed_dict={L: cumul.L, C: cumul.C, K_c: cumul.K_c})
@@ -251,6 +398,76 @@ class NPHC(object):
 
             return sess.run(R)
 
+    def solve_numpy(self, start_point, C_list, K_c_list, training_epochs, learning_rate, optimizer, display_step,
+                    use_average, use_projection, projection_stable_G, positive_baselines, l_mu, full_batch, batch_size):
+        """
+        The loop of `solve` with `backend='numpy'`.
+        """
+        from scipy.linalg import inv, sqrtm
+        d = len(self.L[0])
+        L_list = np.asarray(self.L)
+        L_avg = np.mean(L_list, axis=0)
+        C_avg = np.mean(C_list, axis=0)
+        K_avg = np.mean(K_c_list, axis=0)
+        penalty = dict(alpha=self.alpha, l_l1=self.l_l1, l_l2=self.l_l2)
+        if positive_baselines:
+            penalty.update(L_avg=L_avg, l_mu=l_mu)
+
+        if optimizer == 'lbfgs':
+            from scipy.optimize import minimize
+            if use_projection or projection_stable_G:
+                raise ValueError("In `solve`: `optimizer='lbfgs'` is not available with the projections.")
+            # the stacked cumulants of all the realizations are used whatever `full_batch`
+            cumulants = (L_avg, C_avg, K_avg) if use_average else (L_list, C_list, K_c_list)
+            def fun(x):
+                cost, grad = objective(x.reshape(d, d), *cumulants, **penalty)
+                return cost, grad.ravel()
+            def display(x, n_iter=[0]):
+                if n_iter[0] % display_step == 0:
+                    print("Epoch:", '%04d' % (n_iter[0]), "log10(cost)=", "{:.9f}".format(np.log10(fun(x)[0])))
+                n_iter[0] += 1
+            res = minimize(fun, start_point.ravel(), jac=True, method='L-BFGS-B', callback=display,
+                           options={'maxiter': training_epochs})
+            print("Optimization Finished!")
+            return res.x.reshape(d, d)
+
+        step = numpy_optimizer(optimizer, learning_rate)
+        if use_projection:
+            L_avg_sqrt = np.sqrt(L_avg)
+            L_avg_sqrt_inv = 1./L_avg_sqrt
+            C_avg_sqrt = sqrtm(C_avg)
+            C_avg_sqrt_inv = inv(C_avg_sqrt)
+        if projection_stable_G:
+            C_avg_inv = inv(C_avg)
+
+        R = start_point.astype(np.float64)
+        for epoch in range(training_epochs):
+
+            if epoch % display_step == 0:
+                avg_cost = objective(R, L_list, C_list, K_c_list, **penalty)[0]
+                print("Epoch:", '%04d' % (epoch), "log10(cost)=", "{:.9f}".format(np.log10(avg_cost)))
+
+            if use_average:
+                R = step(R, objective(R, L_avg, C_avg, K_avg, **penalty)[1])
+            else:
+                for batch in epoch_batches(self.n_realizations, full_batch, batch_size):
+                    R = step(R, objective(R, L_list[batch], C_list[batch], K_c_list[batch], **penalty)[1])
+                    if use_projection:
+                        to_be_projected = np.dot(C_avg_sqrt_inv,np.dot(R,np.diag(L_avg_sqrt)))
+                        U, S, V = np.linalg.svd(to_be_projected)
+                        R = np.dot( C_avg_sqrt, np.dot( np.dot(U,V), np.diag(L_avg_sqrt_inv) ) )
+
+            if projection_stable_G:
+                to_be_projected = np.eye(d) - np.dot( np.dot(np.diag(L_avg), R.T), C_avg_inv)
+                U, S, V = np.linalg.svd(to_be_projected)
+                S[S >= .99] = .99
+                G_projected = np.dot( U, np.dot(np.diag(S), V) )
+                R = np.dot(C_avg, np.dot( np.eye(d) - G_projected.T, np.diag(1./L_avg) ) )
+
+        print("Optimization Finished!")
+
+        return R
+
 
 '''
 Run the command line: tensorboard --logdir=/tmp/tf_cumul
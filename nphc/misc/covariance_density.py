@@ -2,17 +2,29 @@
 # multivariate point process, using a function implemented in nphc/utils/cumulants.py.
 
 import numpy as np
-from nphc.cumulants import A_ij_rect
-from joblib import Parallel, delayed
+from nphc.cumulants import A_ij_rect_sweep
+from nphc.realizations import Realizations
 
 def cov_density(realization_i, realization_j, T, L_j, log_start=0., log_end=3, n_points=100):
     H_range = np.logspace(log_start, log_end, n_points)
-    Z = Parallel(-1)(delayed(A_ij_rect)(realization_i, realization_j, -H, H, T, L_j) for H in H_range)
-    Z = np.array(Z)
+    # all the values of H are computed in a single pass over the jumps
+    Z = A_ij_rect_sweep(realization_i, realization_j, H_range, T, L_j)
     X = H_range[:-1]
     Y = np.diff(Z) / np.diff(H_range)
     return X, Y
 
+def cov_density_realizations(realizations, i, j, day=0, **kwargs):
+    # same as `cov_density` for the nodes i and j of a day of a `Realizations`, or of a list of realizations
+    realizations = Realizations.from_lists(realizations)
+    realization = realizations[day]
+    realization_i, realization_j = realization[i], realization[j]
+    if realizations.multiplicities is not None:
+        # the repeated times of run-length encoded realizations are expanded
+        multiplicity = realizations.multiplicity(day)
+        realization_i = np.repeat(realization_i, multiplicity[i])
+        realization_j = np.repeat(realization_j, multiplicity[j])
+    return cov_density(realization_i, realization_j, realizations.time[day], realizations.L[day, j], **kwargs)
+
 if __name__ == "__main__":
     import mlpp.simulation as hk
     import matplotlib.pyplot as plt
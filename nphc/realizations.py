@@ -0,0 +1,165 @@
+import numpy as np
+
+
+class Realizations(object):
+    """
+    Stores several realizations of a d-dimensional point process in one contiguous float64
+    buffer: the timestamps of node i of day `day` are data[offsets[day, i]:offsets[day, i + 1]].
+
+    Indexing by an integer returns the day as a list of d arrays, which are views of the
+    buffer, so that a `Realizations` can be used wherever a list of realizations is expected.
+    Indexing by a slice returns a `Realizations` sharing the same buffer.
+    The lengths T, the numbers of jumps and the intensities L of the days are computed once.
+
+    For tick data with many ties, the realizations can be run-length encoded (see
+    `run_length_encode`): `data` then holds the distinct times of each node, and the array
+    `multiplicities` the number of jumps at each of them.
+
+    Attributes
+    ----------
+
+        data : `np.array` shape=(n_jumps,)
+            Timestamps of all the nodes of all the days
+
+        offsets : `np.array` shape=(n_realizations, dim + 1)
+            Position of the nodes of each day in `data`
+
+        multiplicities : `np.array` shape=(n_jumps,) or None
+            Number of jumps at each time of `data`, for run-length encoded realizations
+
+        counts : `np.array` shape=(n_realizations, dim)
+            Number of jumps of each node on each day
+
+        time : `np.array` shape=(n_realizations,)
+            Length of each day, from its first to its last jump
+
+        L : `np.array` shape=(n_realizations, dim)
+            Mean intensities counts / time
+    """
+
+    def __init__(self, data, offsets, multiplicities=None):
+        self.data = data
+        self.offsets = offsets
+        self.multiplicities = multiplicities
+        if multiplicities is None:
+            self.counts = np.diff(offsets, axis=1)
+        else:
+            cumcount = np.zeros(multiplicities.shape[0] + 1, dtype=np.int64)
+            np.cumsum(multiplicities, out=cumcount[1:])
+            self.counts = np.diff(cumcount[offsets], axis=1)
+        self.time = np.zeros(offsets.shape[0])
+        for day in range(offsets.shape[0]):
+            filled = self.counts[day] > 0
+            first = data[offsets[day, :-1][filled]]
+            last = data[offsets[day, 1:][filled] - 1]
+            self.time[day] = last.max() - first.min()
+        self.L = self.counts / self.time[:, np.newaxis]
+
+    @classmethod
+    def from_lists(cls, realizations):
+        """
+        Builds a `Realizations` from either a single realization, given as a list of arrays of
+        timestamps (one per node), or a list of such realizations. A `Realizations` is
+        returned unchanged.
+        """
+        if isinstance(realizations, cls):
+            return realizations
+        if not all(isinstance(x, (list, tuple)) for x in realizations):
+            realizations = [realizations]
+        lengths = np.array([[len(x) for x in realization] for realization in realizations], dtype=np.int64)
+        offsets = np.zeros((lengths.shape[0], lengths.shape[1] + 1), dtype=np.int64)
+        offsets[:, 1:] = np.cumsum(lengths, axis=1)
+        offsets[1:] += np.cumsum(offsets[:-1, -1])[:, np.newaxis]
+        data = np.empty(offsets[-1, -1])
+        for day, realization in enumerate(realizations):
+            for i, realization_i in enumerate(realization):
+                data[offsets[day, i]:offsets[day, i + 1]] = realization_i
+        return cls(data, offsets)
+
+    @classmethod
+    def from_run_lengths(cls, times, multiplicities):
+        """
+        Builds a run-length encoded `Realizations` from the distinct times of the nodes and
+        their multiplicities, both given like the realizations of `from_lists`.
+        """
+        realizations = cls.from_lists(times)
+        counts = cls.from_lists(multiplicities)
+        return cls(realizations.data, realizations.offsets, counts.data.astype(np.int64))
+
+    def run_length_encode(self):
+        """
+        Returns the run-length encoded version of these realizations: the repeated times of each
+        node are stored once, with their multiplicity.
+        """
+        if self.multiplicities is not None:
+            return self
+        start, end = self.offsets[0, 0], self.offsets[-1, -1]
+        data = self.data[start:end]
+        # a new run starts at each change of time or of node
+        new = np.ones(data.shape[0], dtype=bool)
+        new[1:] = data[1:] != data[:-1]
+        firsts = self.offsets[:, :-1].ravel() - start
+        new[firsts[firsts < data.shape[0]]] = True
+        starts = np.flatnonzero(new)
+        multiplicities = np.diff(np.append(starts, data.shape[0]))
+        offsets = np.searchsorted(starts, self.offsets - start)
+        return Realizations(data[starts], offsets, multiplicities)
+
+    def multiplicity(self, day):
+        """
+        Returns the multiplicities of the times of the day `day` (views), or None when the
+        realizations are not run-length encoded.
+        """
+        if self.multiplicities is None:
+            return None
+        offsets = self.offsets[day]
+        return [self.multiplicities[offsets[i]:offsets[i + 1]] for i in range(self.dim)]
+
+    @property
+    def n_realizations(self):
+        return self.offsets.shape[0]
+
+    @property
+    def dim(self):
+        return self.offsets.shape[1] - 1
+
+    def __len__(self):
+        return self.n_realizations
+
+    def __getitem__(self, day):
+        if isinstance(day, slice):
+            return Realizations(self.data, self.offsets[day], self.multiplicities)
+        offsets = self.offsets[day]
+        return [self.data[offsets[i]:offsets[i + 1]] for i in range(self.dim)]
+
+    def __iter__(self):
+        for day in range(self.n_realizations):
+            yield self[day]
+
+    def flat(self, day):
+        """
+        Returns the timestamps of the day `day` as one array, a view of the buffer, together
+        with the offsets of its nodes in this array.
+        """
+        offsets = self.offsets[day]
+        return self.data[offsets[0]:offsets[-1]], offsets - offsets[0]
+
+    def copy(self):
+        state = self.__getstate__()
+        multiplicities = state['multiplicities']
+        return Realizations(state['data'].copy(), state['offsets'], None if multiplicities is None else multiplicities.copy())
+
+    def to_lists(self):
+        if self.multiplicities is None:
+            return [[x.copy() for x in realization] for realization in self]
+        return [[np.repeat(x, m) for (x, m) in zip(self[day], self.multiplicity(day))]
+                for day in range(self.n_realizations)]
+
+    def __getstate__(self):
+        # only the part of the buffers used by these days is pickled
+        start, end = self.offsets[0, 0], self.offsets[-1, -1]
+        multiplicities = None if self.multiplicities is None else self.multiplicities[start:end]
+        return {'data': self.data[start:end], 'offsets': self.offsets - start, 'multiplicities': multiplicities}
+
+    def __setstate__(self, state):
+        self.__init__(state['data'], state['offsets'], state.get('multiplicities'))
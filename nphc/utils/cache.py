@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+from hashlib import blake2b
+import numpy as np
+
+# to be increased whenever a change of the estimators modifies their values,
+# so that the cumulants cached by the previous versions are not used anymore
+ESTIMATOR_VERSION = 1
+
+FIELDS = ('L', 'C', 'J', 'E_c', 'K_c')
+
+
+def cache_key(realizations, **params):
+    """
+    Returns the hexadecimal blake2b digest of the buffers of the `Realizations` `realizations`,
+    of the parameters `params` and of ESTIMATOR_VERSION.
+    """
+    h = blake2b(digest_size=20)
+    start, end = realizations.offsets[0, 0], realizations.offsets[-1, -1]
+    h.update(np.ascontiguousarray(realizations.data[start:end]).view(np.uint8))
+    h.update(np.ascontiguousarray(realizations.offsets - start, dtype=np.int64).view(np.uint8))
+    if realizations.multiplicities is not None:
+        h.update(np.ascontiguousarray(realizations.multiplicities[start:end], dtype=np.int64).view(np.uint8))
+    h.update(repr(sorted(params.items())).encode())
+    h.update(repr(ESTIMATOR_VERSION).encode())
+    return h.hexdigest()
+
+
+def load(cache_dir, key):
+    """
+    Returns the dict of the cumulants stored under `key` in `cache_dir`, as read-only memory
+    maps, or None when they are not cached. A hit marks the entry as recently used.
+    """
+    path = os.path.join(cache_dir, key)
+    if not os.path.isdir(path):
+        return None
+    try:
+        cumulants = dict((field, np.load(os.path.join(path, field + '.npy'), mmap_mode='r')) for field in FIELDS)
+    except (IOError, OSError, ValueError):
+        return None
+    os.utime(path, None)
+    return cumulants
+
+
+def store(cache_dir, key, cumulants, max_size=2 ** 30):
+    """
+    Stores the arrays of the dict `cumulants` (one .npy file per field of FIELDS) under `key`
+    in `cache_dir`, then removes the least recently used entries until the cache takes at
+    most `max_size` bytes. The entry is written in a temporary folder and renamed, so that
+    a concurrent `load` never sees a partial entry.
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    tmp = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp')
+    for field in FIELDS:
+        np.save(os.path.join(tmp, field + '.npy'), np.asarray(cumulants[field]))
+    try:
+        os.rename(tmp, os.path.join(cache_dir, key))
+    except OSError:
+        # the same entry was stored meanwhile
+        shutil.rmtree(tmp, ignore_errors=True)
+    evict(cache_dir, max_size)
+
+
+def evict(cache_dir, max_size):
+    entries = []
+    for key in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, key)
+        if key.startswith('.') or not os.path.isdir(path):
+            continue
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        entries.append((os.path.getmtime(path), size, path))
+    entries.sort()
+    total = sum(size for (_, size, _) in entries)
+    for (_, size, path) in entries:
+        if total <= max_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
@@ -28,3 +28,120 @@ def load_data(url):
         data = pickle.load(f)    
     f.close()
     return data
+
+
+# Columnar format of the results: a folder holding one uncompressed .npy file per array, so
+# that any part of it can be memory-mapped and read without the rest.
+#   format.json                    version, half_width, dim, n_realizations and keep (and n_days)
+#   time.npy, L.npy, C.npy, J.npy, E_c.npy, K_c.npy       per-day cumulants, stacked, or their
+#                                  means (one row) when keep is `mean`
+#   M2/<name>.npy                  with keep `mean`, the sums of squared deviations to the means
+#   L_th.npy, C_th.npy, K_c_th.npy, R_true.npy, mu_true.npy   when known
+#   params/<name>.npy              ground-truth parameters (Alpha, Beta, Gamma...)
+#   realizations/data.npy, offsets.npy[, multiplicities.npy]  the timestamps, see `Realizations`
+
+# 2: keep and the sums of squared deviations of `Cumulants(keep='mean')`
+FORMAT_VERSION = 2
+
+CUMULANTS = {'time': 'time', 'L': 'L', 'C': 'C', 'J': '_J', 'E_c': '_E_c', 'K_c': 'K_c'}
+TRUTH = ('L_th', 'C_th', 'K_c_th', 'R_true', 'mu_true')
+
+
+def save_cumulants(path, cumul, params=None, with_N=True):
+    """
+    Saves the `Cumulants` `cumul`, the dict of arrays `params` and, if `with_N` is True, the
+    realizations in the folder `path`, in the columnar format above.
+    """
+    import os, json
+    import numpy as np
+    for folder in (path, os.path.join(path, 'params'), os.path.join(path, 'realizations')):
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+    for name, attr in CUMULANTS.items():
+        np.save(os.path.join(path, name + '.npy'), np.asarray(getattr(cumul, attr)))
+    if cumul.keep == 'mean':
+        if not os.path.isdir(os.path.join(path, 'M2')):
+            os.makedirs(os.path.join(path, 'M2'))
+        for name, attr in CUMULANTS.items():
+            if attr in cumul._M2:
+                np.save(os.path.join(path, 'M2', name + '.npy'), cumul._M2[attr])
+    for name in TRUTH:
+        if getattr(cumul, name, None) is not None:
+            np.save(os.path.join(path, name + '.npy'), np.asarray(getattr(cumul, name)))
+    for name, value in (params or {}).items():
+        np.save(os.path.join(path, 'params', name + '.npy'), np.asarray(value))
+    realizations = cumul.realizations
+    if with_N and realizations is not None:
+        state = realizations.__getstate__()
+        for name, value in state.items():
+            if value is not None:
+                np.save(os.path.join(path, 'realizations', name + '.npy'), value)
+    header = {'version': FORMAT_VERSION, 'half_width': float(cumul.half_width), 'dim': int(cumul.dim),
+              'n_realizations': int(cumul.n_realizations), 'keep': cumul.keep}
+    if cumul.keep == 'mean':
+        header['n_days'] = int(cumul.n_days)
+    # written last: a folder without it is an incomplete save
+    with open(os.path.join(path, 'format.json'), 'w') as f:
+        json.dump(header, f)
+
+
+def load_cumulants(path, days=None, with_N=False, with_params=True, mmap_mode='r'):
+    """
+    Loads the `Cumulants` saved by `save_cumulants` in the folder `path`, with the arrays
+    memory-mapped (`mmap_mode`, None to read them in memory). `days` (a slice or a list of
+    indices) selects a subset of the realizations, which is not possible for the means saved
+    by `Cumulants(keep='mean')`. The realizations are only loaded if `with_N` is True and
+    they were saved.
+    Returns the `Cumulants`, and the dict of the parameters if `with_params` is True.
+    """
+    import os, json
+    import numpy as np
+    from nphc.cumulants import Cumulants
+    from nphc.realizations import Realizations
+    from nphc.utils.stats import Stats
+    with open(os.path.join(path, 'format.json')) as f:
+        header = json.load(f)
+    if header['version'] > FORMAT_VERSION:
+        raise ValueError("In `load_cumulants`: the results in %s have the format version %d, this version of nphc "
+                         "reads up to %d." % (path, header['version'], FORMAT_VERSION))
+    keep = header.get('keep', 'all')
+    if keep == 'mean' and days is not None:
+        raise ValueError("In `load_cumulants`: `days` should be None for the means saved with `keep='mean'`.")
+    if days is None:
+        days = slice(None)
+
+    def load(name):
+        filename = os.path.join(path, name + '.npy')
+        if not os.path.isfile(filename):
+            return None
+        return np.load(filename, mmap_mode=mmap_mode)
+
+    cumul = Cumulants.__new__(Cumulants)
+    cumul.keep = keep
+    cumul.stats = Stats()
+    cumul.days = None
+    cumul.realizations = None
+    cumul.half_width = header['half_width']
+    cumul.dim = header['dim']
+    for name, attr in CUMULANTS.items():
+        setattr(cumul, attr, load(name)[days])
+    cumul.n_realizations = len(cumul.time)
+    if keep == 'mean':
+        cumul.n_days = header['n_days']
+        cumul._M2 = dict((attr, load(os.path.join('M2', name))) for name, attr in CUMULANTS.items()
+                         if attr in Cumulants._AGGREGATED)
+    for name in TRUTH:
+        setattr(cumul, name, load(name))
+    if with_N and os.path.isfile(os.path.join(path, 'realizations', 'data.npy')):
+        state = dict((name, load(os.path.join('realizations', name)))
+                     for name in ('data', 'offsets', 'multiplicities'))
+        cumul.realizations = Realizations(state['data'], state['offsets'][days], state['multiplicities'])
+
+    if not with_params:
+        return cumul
+    params = {}
+    if os.path.isdir(os.path.join(path, 'params')):
+        for filename in sorted(os.listdir(os.path.join(path, 'params'))):
+            if filename.endswith('.npy'):
+                params[filename[:-4]] = load(os.path.join('params', filename[:-4]))
+    return cumul, params
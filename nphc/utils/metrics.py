@@ -1,6 +1,4 @@
 import numpy as np
-from scipy.stats import kendalltau
-from nphc.cumulants import get_K_c_th
 
 def rel_err(A_true, A_pred):
     assert A_pred.shape == A_true.shape, "A_pred and A_true should have the same dimensions."
@@ -16,6 +14,7 @@ def rank_corr(A_true, A_pred):
     RankCorr is defined as the averaged Kendall's rank correlation coefficient between each row of A_true and A_pred
     """
     import math
+    from scipy.stats import kendalltau
     res = 0.
     tmp = 0
     for (x_true, x_pred) in zip(A_true, A_pred):
@@ -50,6 +49,7 @@ def sq_frobenius(X):
 #    return .5/(cumul.dim**3) * sq_frobenius(cumul.K - K_from_R)
 
 def mse_K_c(cumul, R):
+    from nphc.cumulants import get_K_c_th
     d = cumul.dim
     if R.shape[0] == d**2:
         R_ = R.reshape(d,d)
@@ -1,5 +1,4 @@
 import numpy as np
-from numba import autojit
 from numpy.linalg import LinAlgError
 
 #@autojit
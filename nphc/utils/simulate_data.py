@@ -260,7 +260,8 @@ def simulate_and_compute_cumul(mu, kernels, Alpha, T, hM=20):
     h.simulate()
     # use the class Cumulants
     from nphc.cumulants import Cumulants
-    N = h.timestamps
+    from nphc.realizations import Realizations
+    N = Realizations.from_lists(h.timestamps)
     cumul = Cumulants(realizations=N, half_width=hM)
     # compute everything
     from scipy.linalg import inv
@@ -281,7 +282,7 @@ def simulate_and_compute_cumul(mu, kernels, Alpha, T, hM=20):
 def save(cumul, Alpha, Beta, Gamma, kernel, mode, T, with_params=True, without_N=False, suffix=''):
 
     from math import log10
-    import gzip, pickle
+    from nphc.utils.loader import save_cumulants
     name = kernel + '_' + mode + '_log10T' + str(int(log10(T)))
 
     # Create folders if they don't exist yet
@@ -290,33 +291,15 @@ def save(cumul, Alpha, Beta, Gamma, kernel, mode, T, with_params=True, without_N
     if not os.path.isdir(dir_name):
         os.mkdir(dir_name)
 
-    if with_params and without_N:
-        tmp = cumul.realizations.copy()
-        cumul.realizations = None
-        data = (cumul,Alpha,Beta,Gamma)
-        f = gzip.open(dir_name + '/' + name + '_with_params_without_N' + suffix + '.pkl.gz','wb')
-        pickle.dump(data, f, protocol=2)
-        f.close()
-        cumul.realizations = tmp
-
-    elif with_params and not without_N:
-        data = (cumul,Alpha,Beta,Gamma)
-        f = gzip.open(dir_name + '/' + name + '_with_params' + suffix + '.pkl.gz','wb')
-        pickle.dump(data, f, protocol=2)
-        f.close()
-
-    elif not with_params and without_N:
-        tmp = cumul.realizations.copy()
-        cumul.realizations = None
-        f = gzip.open(dir_name + '/' + name + '_without_N' + suffix + '.pkl.gz','wb')
-        pickle.dump(cumul, f, protocol=2)
-        f.close()
-        cumul.realizations = tmp
-
-    elif not with_params and not without_N:
-        f = gzip.open(dir_name + '/' + name + suffix + '.pkl.gz','wb')
-        pickle.dump(cumul, f, protocol=2)
-        f.close()
+    # one folder of .npy arrays per simulation, see `nphc.utils.loader.save_cumulants`
+    if with_params:
+        name += '_with_params'
+        params = {'Alpha': Alpha, 'Beta': Beta, 'Gamma': Gamma}
+    else:
+        params = None
+    if without_N:
+        name += '_without_N'
+    save_cumulants(dir_name + '/' + name + suffix, cumul, params=params, with_N=not without_N)
 
 
 if __name__ == '__main__':
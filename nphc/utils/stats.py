@@ -0,0 +1,117 @@
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+
+logger = logging.getLogger('nphc')
+
+
+def payload_bytes(args):
+    """
+    Returns the number of bytes of the arrays found in `args`, looking into lists, tuples and
+    dicts. Memory-mapped arrays are passed to the workers as references and are not counted.
+    """
+    n = 0
+    for x in args:
+        if isinstance(x, np.memmap):
+            continue
+        elif isinstance(x, np.ndarray):
+            n += x.nbytes
+        elif isinstance(x, (list, tuple)):
+            n += payload_bytes(x)
+        elif isinstance(x, dict):
+            n += payload_bytes(x.values())
+    return n
+
+
+def timed_job(fun, *args, **kwargs):
+    """
+    Runs fun(*args, **kwargs), typically in a joblib worker, and returns its result together
+    with the elapsed wall time and the number of bytes of the arrays it received.
+    """
+    start = time.perf_counter()
+    result = fun(*args, **kwargs)
+    return result, time.perf_counter() - start, payload_bytes(args) + payload_bytes(kwargs.values())
+
+
+class Stats(object):
+    """
+    Collects the instrumentation of the computation of the cumulants.
+
+    Attributes
+    ----------
+
+        stages : `OrderedDict`
+            For each stage (`L`, `C_and_J`, `E_c`, `fused`...), a dict with its wall and CPU
+            times in seconds (the CPU time of this process only), its number of events and
+            their throughput, and for the stages run by a pool of workers, its number of jobs,
+            the time the workers spent on them (`busy`), the rest of the time of the pool
+            (`idle`) and the bytes of arrays sent to the workers (`bytes_shipped`).
+
+        pairs : `dict`
+            The time of the kernel of the sampled pairs (i, j), for each stage, see
+            `Cumulants.profile_pairs`.
+
+    `callback` is called with the name of each stage and its dict when it ends; by default,
+    a summary line is sent to the `nphc` logger at the INFO level.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stages = OrderedDict()
+        self.pairs = {}
+
+    @staticmethod
+    def new_record(n_events=0, n_workers=1):
+        return {'wall': 0., 'cpu': 0., 'n_events': n_events, 'events_per_second': 0.,
+                'n_workers': n_workers, 'n_jobs': 0, 'busy': 0., 'idle': 0., 'bytes_shipped': 0}
+
+    @contextmanager
+    def stage(self, name, n_events=0, n_workers=1):
+        """
+        Measures the stage `name` run in the context. The record of the stage is yielded, so
+        that its number of events can be set when it is only known at the end.
+        """
+        record = self.new_record(n_events, n_workers)
+        self.stages[name] = record
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield record
+        record['wall'] = time.perf_counter() - wall
+        record['cpu'] = time.process_time() - cpu
+        if record['wall'] > 0:
+            record['events_per_second'] = record['n_events'] / record['wall']
+        if record['n_jobs'] > 0:
+            record['idle'] = max(0., record['n_workers'] * record['wall'] - record['busy'])
+        self.report(name, record)
+
+    def jobs(self, name, results):
+        """
+        Yields the results of jobs run with `timed_job`, adding their times and payloads to the
+        record of the stage `name`.
+        """
+        record = self.stages.setdefault(name, self.new_record())
+        for result, elapsed, n_bytes in results:
+            record['n_jobs'] += 1
+            record['busy'] += elapsed
+            record['bytes_shipped'] += n_bytes
+            yield result
+
+    def report(self, name, record):
+        if self.callback is not None:
+            self.callback(name, record)
+        else:
+            logger.info("%s is computed: %.3fs wall, %.3fs cpu, %.3g events/s", name, record['wall'], record['cpu'],
+                        record['events_per_second'])
+
+    def summary(self):
+        lines = ["%-16s %10s %10s %12s %8s %10s %10s %14s" % ('stage', 'wall (s)', 'cpu (s)', 'events/s', 'jobs',
+                                                            'busy (s)', 'idle (s)', 'bytes shipped')]
+        for name, r in self.stages.items():
+            lines.append("%-16s %10.3f %10.3f %12.3g %8d %10.3f %10.3f %14d" % (name, r['wall'], r['cpu'],
+                         r['events_per_second'], r['n_jobs'], r['busy'], r['idle'], r['bytes_shipped']))
+        for name, times in self.pairs.items():
+            slowest = sorted(times.items(), key=lambda x: -x[1])[:5]
+            lines.append("%s, slowest sampled pairs: %s" % (name, ", ".join("(%d, %d) %.2es" % (i, j, t)
+                                                                             for ((i, j), t) in slowest)))
+        return "\n".join(lines)
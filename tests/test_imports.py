@@ -0,0 +1,32 @@
+import json
+import os
+import subprocess
+import sys
+
+# importing the package, to compute cumulants or metrics, should not load the heavy
+# dependencies, which are imported by the code paths needing them
+HEAVY = ('tensorflow', 'numba', 'joblib', 'scipy')
+BUDGET = 1.5  # seconds, numpy included
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import nphc.main, nphc.cumulants, nphc.utils.metrics
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'modules': sorted(set(name.split('.')[0] for name in sys.modules))}))
+"""
+
+
+def run_import():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT], cwd=root)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def test_no_heavy_dependency_is_imported():
+    modules = run_import()['modules']
+    assert [name for name in HEAVY if name in modules] == []
+
+
+def test_import_time_budget():
+    assert run_import()['elapsed'] < BUDGET